@@ -1,15 +1,29 @@
 #!/usr/bin/env python3
 
+import hashlib
+import inspect
 import json
+import logging
 import os
-import pprint
+import pickle
 import re
+import sys
+import tempfile
 
 from enum import Enum
 from collections import namedtuple
 
 import argparse
 
+mydir = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(mydir, "..", "..", "utils"))
+from lib.rr_graph.channel import pack_tracks
+from lib.rr_graph.store import GraphStore
+from lib.rr_graph.stitch import PartialGraph, stitch
+from lib.rr_graph.stream import read_sections
+import lib.log
+from lib.log import LazyPFormat
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -30,11 +44,42 @@ parser.add_argument(
         '--read_rr_graph', help='Input rr_graph file')
 parser.add_argument(
         '--write_rr_graph', help='Output rr_graph file')
+parser.add_argument(
+        '--region', type=int, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'),
+        help='Only generate the nodes for this part of the grid (with --write_partial)')
+partial_args = parser.add_mutually_exclusive_group()
+partial_args.add_argument(
+        '--write_partial',
+        help='Write the nodes for --region to this file, to be stitched later')
+partial_args.add_argument(
+        '--read_partials', nargs='+', metavar='PARTIAL',
+        help='Stitch together the partial graphs rather than tracing the wires')
+
+parser.add_argument(
+        '--compact_channels', action='store_true',
+        help='Pack the channels into as few tracks as possible to reduce the number of filler nodes')
 
 parser.add_argument(
         '--verbose', action='store_const', const=True, default=False)
+parser.add_argument(
+        '--log_verbosity', type=int, default=0,
+        help='-1 for only warnings, 0 for a summary of each step, 1 for everything')
+parser.add_argument(
+        '--log_json', help='Write every log message to this file as JSON lines')
+parser.add_argument(
+        '--routing_trace', help='Write the trace of every routing node to this file')
+parser.add_argument(
+        '--db_cache',
+        help='Cache the processed database in this file (default no cache)')
+parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of processes to use for tracing the wires')
 
 args = parser.parse_args()
+if args.region and not args.write_partial:
+    parser.error("--region only makes sense with --write_partial")
+
+log = lib.log.setup("prjxray-routing-import", args.log_verbosity, args.log_json)
 
 
 class OrderedEnum(Enum):
@@ -203,8 +248,7 @@ doctest.testmod()
 
 
 
-compass = {}
-def add(tile_from, dir, tile_to, pairs):
+def add(compass, tile_from, dir, tile_to, pairs):
     if tile_from not in compass:
         compass[tile_from] = {}
 
@@ -223,65 +267,123 @@ def db_open(n):
     return json.load(open(p))
 
 
-for conns in db_open("tileconn.json"):
-    assert "grid_deltas" in conns and len(conns["grid_deltas"]) == 2
-    assert "tile_types" in conns and len(conns["tile_types"]) == 2
-    assert "wire_pairs" in conns
-
-    tile_from, tile_to = conns["tile_types"]
-    dir = CompassDir.from_coords(conns["grid_deltas"])
-    if not dir:
-        print("Skipping %s -> %s" % (tile_from, tile_to))
-        continue
+def read_tile_connections():
+    """Build the tile type connection tables from tileconn.json.
 
-    print("%20s" % tile_from, dir, tile_to)
-
-    add(tile_from, dir, tile_to, conns["wire_pairs"])
-    dir = dir.flip()
-    add(tile_to, dir, tile_from, ((b,a) for a,b in conns["wire_pairs"]))
+    Returns compass, has_conns_compass and no_conns_compass.
+    """
+    compass = {}
+    for conns in db_open("tileconn.json"):
+        assert "grid_deltas" in conns and len(conns["grid_deltas"]) == 2
+        assert "tile_types" in conns and len(conns["tile_types"]) == 2
+        assert "wire_pairs" in conns
+
+        tile_from, tile_to = conns["tile_types"]
+        dir = CompassDir.from_coords(conns["grid_deltas"])
+        if not dir:
+            log.debug("Skipping %s -> %s", tile_from, tile_to)
+            continue
 
-tile_types = list(compass.keys())
+        log.debug("%20s %s %s", tile_from, dir, tile_to)
+        lib.log.count("connection")
 
-has_conns_compass = {}
-no_conns_compass = {}
-for tile_type_a in tile_types:
-    print()
-    print("%s type" % tile_type_a)
-    no_conns_compass[tile_type_a] = {}
-    has_conns_compass[tile_type_a] = {}
-    for dir in CompassDir.straight:
-        has_connections = []
-        no_connections = []
+        add(compass, tile_from, dir, tile_to, conns["wire_pairs"])
+        dir = dir.flip()
+        add(compass, tile_to, dir, tile_from, ((b,a) for a,b in conns["wire_pairs"]))
 
-        for tile_type_b in tile_types:
-            look_for = (dir, tile_type_b)
+    tile_types = list(compass.keys())
 
-            if look_for in compass[tile_type_a].keys():
-                has_connections.append(tile_type_b)
+    has_conns_compass = {}
+    no_conns_compass = {}
+    for tile_type_a in tile_types:
+        log.debug("%s type", tile_type_a)
+        no_conns_compass[tile_type_a] = {}
+        has_conns_compass[tile_type_a] = {}
+        for dir in CompassDir.straight:
+            has_connections = set()
+            no_connections = set()
+
+            for tile_type_b in tile_types:
+                look_for = (dir, tile_type_b)
+
+                if look_for in compass[tile_type_a]:
+                    has_connections.add(tile_type_b)
+                else:
+                    no_connections.add(tile_type_b)
+
+            log.debug("On %s has connections to [%-30s] and none to %i other tile types", dir, " ".join(sorted(has_connections)), len(no_connections))
+
+            assert len(has_connections) + len(no_connections) == len(tile_types)
+
+            no_conns_compass[tile_type_a][dir] = no_connections
+            has_conns_compass[tile_type_a][dir] = has_connections
+
+    return compass, has_conns_compass, no_conns_compass
+
+
+def read_tile_grid():
+    """Build the (x, y) -> tile type map from tilegrid.json."""
+    grid = {}
+    for tile_name, tile_details in db_open("tilegrid.json")["tiles"].items():
+        assert "grid_x" in tile_details, (tile_name, tile_details)
+        assert "grid_y" in tile_details, (tile_name, tile_details)
+        assert "type" in tile_details, (tile_name, tile_details)
+
+        grid[(tile_details["grid_x"], tile_details["grid_y"])] = tile_details["type"]
+        lib.log.count("tile")
+    return grid
+
+
+def db_cache_key():
+    """Hash of the database files and the code used to process them."""
+    h = hashlib.sha256()
+    for n in ("tileconn.json", "tilegrid.json"):
+        with open(os.path.join(args.database, n), "rb") as f:
+            for chunk in iter(lambda: f.read(1024*1024), b""):
+                h.update(chunk)
+    for obj in (CompassDir, add, read_tile_connections, read_tile_grid):
+        h.update(inspect.getsource(obj).encode("utf-8"))
+    return h.hexdigest()
+
+
+lib.log.start_phase(log, "Reading Project X-Ray database")
+db = None
+if args.db_cache:
+    db_key = db_cache_key()
+    if os.path.exists(args.db_cache):
+        try:
+            with open(args.db_cache, "rb") as f:
+                cached_key, cached_db = pickle.load(f)
+        except Exception as e:
+            # Treat a truncated or otherwise unreadable cache as a miss.
+            log.info("Ignoring unreadable cached database in %s: %r", args.db_cache, e)
+        else:
+            if cached_key == db_key:
+                log.info("Using cached database from %s", args.db_cache)
+                db = cached_db
             else:
-                no_connections.append(tile_type_b)
-
-        print("On %s has connections to [%-30s] and none to %i other tile types" % (dir, " ".join(has_connections), len(no_connections)))
-
-        assert len(has_connections) + len(no_connections) == len(tile_types)
-
-        no_conns_compass[tile_type_a][dir] = no_connections
-        has_conns_compass[tile_type_a][dir] = has_connections
-
-grid = {}
-for tile_name, tile_details in db_open("tilegrid.json")["tiles"].items():
-    assert "grid_x" in tile_details, (tile_name, tile_details)
-    assert "grid_y" in tile_details, (tile_name, tile_details)
-    assert "type" in tile_details, (tile_name, tile_details)
-
-    grid[(tile_details["grid_x"], tile_details["grid_y"])] = tile_details["type"]
+                log.info("Cached database in %s is out of date", args.db_cache)
+
+if db is None:
+    db = read_tile_connections() + (read_tile_grid(),)
+    if args.db_cache:
+        # Write to a temporary file first, so other runs sharing the cache
+        # (e.g. under make -j) never see a partial file.
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(args.db_cache)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((db_key, db), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, args.db_cache)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+compass, has_conns_compass, no_conns_compass, grid = db
 
 grid_min = (min(x for x,y in grid), min(y for x,y in grid))
 grid_max = (max(x for x,y in grid), max(y for x,y in grid))
 
-print()
-print(grid_min, "to", grid_max)
-print()
+log.info("Grid is %s to %s", grid_min, grid_max)
 
 
 if args.end_x == -1:
@@ -289,6 +391,48 @@ if args.end_x == -1:
 if args.end_y == -1:
     args.end_y = grid_max[1]
 
+# The part of the grid whose wires and pins are generated. The node
+# positions are still relative to --start_x/--start_y so the partial graphs
+# of the regions all line up.
+if args.region:
+    region = ((args.region[0], args.region[1]), (args.region[2], args.region[3]))
+else:
+    region = ((args.start_x, args.start_y), (args.end_x, args.end_y))
+
+
+def partial_key():
+    """Hash of everything a partial graph is generated from."""
+    h = hashlib.sha256()
+    h.update(db_cache_key().encode("utf-8"))
+    with open(args.read_rr_graph, "rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            h.update(chunk)
+    # This script and the modules which build / save the partial graph.
+    sources = [__file__] + [
+        inspect.getsourcefile(obj) for obj in (GraphStore, PartialGraph, pack_tracks, read_sections)]
+    for source in sources:
+        with open(source, "rb") as f:
+            h.update(f.read())
+    window = (args.start_x, args.start_y, args.end_x, args.end_y)
+    h.update(repr((window, region)).encode("utf-8"))
+    return h.hexdigest()
+
+
+partial = None
+if args.write_partial:
+    key = partial_key()
+    if os.path.exists(args.write_partial):
+        try:
+            old_key = PartialGraph.load(args.write_partial).key
+        except Exception as e:
+            # Treat a truncated or otherwise unreadable partial as stale.
+            log.info("Ignoring unreadable partial graph %s: %r", args.write_partial, e)
+            old_key = None
+        if old_key == key:
+            log.info("Partial graph %s for %s is up to date", args.write_partial, region)
+            sys.exit(0)
+    partial = PartialGraph(region, key)
+
 
 def wire_type(a):
     if isinstance(a, tuple):
@@ -339,47 +483,65 @@ def find_wire_type(wire_name, wire_coord, leaves_via):
     if wire_name.startswith("LV") or wire_name.startswith("LH"):
         return "LONGEND"
 
-    print("Unknown wire on %s (%s): %s %s" % (wire_coord, grid[wire_coord], wire_name, leaves_via))
+    log.debug("Unknown wire on %s (%s): %s %s", wire_coord, grid[wire_coord], wire_name, leaves_via)
     return "PASS"
 
 
 # Build a neighbour look up table
+lib.log.start_phase(log, "Building neighbour look up table")
+
+# Number the tile types and store the grid as a flat list of type ids with a
+# border of NULL tiles around it. The neighbour in a direction is then just
+# at a fixed offset from the tile's index, with no bounds checks needed.
+tile_type_names = ["NULL"] + sorted(set(grid.values()) - {"NULL"})
+tile_type_ids = {t: i for i, t in enumerate(tile_type_names)}
+NULL_ID = tile_type_ids["NULL"]
+
+grid_width = grid_max[0] - grid_min[0] + 3
+grid_height = grid_max[1] - grid_min[1] + 3
+grid_ids = [NULL_ID] * (grid_width * grid_height)
+for (x, y), tile_type in grid.items():
+    grid_ids[(y - grid_min[1] + 1) * grid_width + (x - grid_min[0] + 1)] = tile_type_ids[tile_type]
+
+# For each direction, the index offset of the neighbour and the set of
+# (tile type id, neighbour type id) pairs which are connected.
+neighbour_lookup = []
+for dir in CompassDir.straight:
+    connected = set()
+    for tile_type, dirs in has_conns_compass.items():
+        if tile_type not in tile_type_ids or tile_type == "NULL":
+            continue
+        for neigh_type in dirs[dir]:
+            if neigh_type not in tile_type_ids or neigh_type == "NULL":
+                continue
+            connected.add((tile_type_ids[tile_type], tile_type_ids[neigh_type]))
+    neighbour_lookup.append((dir, dir.y * grid_width + dir.x, connected))
+
 for y in range(grid_min[1], grid_max[1]+1):
+    row = (y - grid_min[1] + 1) * grid_width - grid_min[0] + 1
     for x in range(grid_min[0], grid_max[0]+1):
         coord = (x, y)
         wires_start_map[coord] = set()
 
-        tile_type = grid[coord]
+        i = row + x
+        type_id = grid_ids[i]
+        tile_type = tile_type_names[type_id]
 
-        print()
-        print("Tile %s is %s" % (coord, tile_type))
+        log.debug("Tile %s is %s", coord, tile_type)
 
-        if tile_type == "NULL":
-            print("Skipping %s as NULL tile" % (coord,))
+        if type_id == NULL_ID:
+            log.debug("Skipping %s as NULL tile", coord)
+            lib.log.count("NULL tile")
             continue
+        lib.log.count("tile")
 
         neighbours = {}
-        for dir in CompassDir.straight:
-            neigh_coord = coord + dir
-            print(coord, dir, neigh_coord, end=" ")
-            if neigh_coord[0] < grid_min[0] or neigh_coord[1] < grid_min[1] or neigh_coord[0] > grid_max[0] or neigh_coord[1] > grid_max[1]:
-                print("Skipping %s (%s) as outside grid" % (dir, neigh_coord))
-                continue
-
-            neigh_type = grid[neigh_coord]
-            if neigh_type == "NULL":
-                print("Skipping %s (%s) as NULL tile"  % (dir, neigh_coord))
-                continue
+        for dir, offset, connected in neighbour_lookup:
+            neigh_id = grid_ids[i + offset]
+            if (type_id, neigh_id) in connected:
+                neighbours[dir] = tile_type_names[neigh_id]
 
-            if neigh_type in no_conns_compass[tile_type][dir]:
-                print("Skipping %s (%s) as %s tile has no connections to %s" % (
-                    dir, neigh_coord, neigh_type, tile_type))
-                continue
-
-            print()
-            neighbours[dir] = grid[neigh_coord]
-
-        print("Tile: %10s (%20s) has connected neighbours: %s" % (coord, tile_type, neighbours))
+        log.debug("Tile: %10s (%20s) has connected neighbours: %s", coord, tile_type, neighbours)
 
         tile_compass = compass[tile_type]
         wires = set()
@@ -416,17 +578,17 @@ for y in range(grid_min[1], grid_max[1]+1):
                 assert False, "Unknown type: %s (%s %s)" % (wire_type, wa, leaves_via)
 
         wires_start_map[coord] = wires_start
-        print("""\
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("""\
 Tile: %10s (%20s) has wires (%i total), %i passing thru and
     %s starting - [%s]
     %s ending   - [%s]
-    %s passing  - [%s]""" % (
+    %s passing  - [%s]""",
                 coord, tile_type, len(wires), len(wires_pass),
                 len(wires_start), " ".join(sorted(wires_start)),
                 len(wires_end),   " ".join(sorted(wires_end)),
                 len(wires_pass),  " ".join(sorted(wires_pass)),
             )
-        )
 
         """
         wires_start_groups = []
@@ -453,6 +615,56 @@ def assert_startname(wire_name):
 def assert_endname(wire_name):
     assert "END" in wire_name or wire_name.startswith("LH") or wire_name.startswith("LV"), wire_name
 
+def _trace_step(left_name, enters_via, enters_name, enters_coord):
+    """Work out the next entry in a trace after entering a wire."""
+    log.debug("%s %s %s", enters_via, enters_name, enters_coord)
+
+    possible_leaving_dirs = list(wires_compass_map[enters_coord][enters_name])
+    log.debug("possible_leaving_dirs %s %s", possible_leaving_dirs, (enters_via, left_name))
+
+    enters_type = find_wire_type(enters_name, enters_coord, possible_leaving_dirs)
+    if enters_type == "START" or (enters_type == "LONGEND" and enters_via == START_STR):
+        assert_startname(enters_name)
+        assert len(possible_leaving_dirs) == 1, possible_leaving_dirs
+        assert enters_via == START_STR, (enters_via, enters_name, enters_coord)
+    elif enters_type == "END" or (enters_type == "LONGEND" and enters_via != START_STR):
+        assert_endname(enters_name)
+        assert len(possible_leaving_dirs) == 1, possible_leaving_dirs
+        return (enters_coord, enters_name, END_STR, "[ ]", '', '', '')
+    elif enters_type == "LEAVES":
+        assert len(possible_leaving_dirs) == 1, possible_leaving_dirs
+        return (enters_coord, enters_name, LEAVE_STR, "[ ]", '', '', '')
+    elif enters_type == "PASS":
+        assert len(possible_leaving_dirs) == 2, possible_leaving_dirs
+    else:
+        assert False, "Unknown wire type: %s (%s %s %s)" % (
+                enters_type, enters_name, enters_coord, possible_leaving_dirs)
+
+    actual_leaving_via = [i for i in possible_leaving_dirs if i != (enters_via, left_name)]
+    log.debug("   actual_leaving_via %s", actual_leaving_via)
+    assert len(actual_leaving_via) == 1, (possible_leaving_dirs, enters_via, actual_leaving_via)
+
+    new_left_coord = enters_coord
+    new_left_name = enters_name
+    new_left_via = actual_leaving_via[0][0]
+    new_enters_via = new_left_via.flip()
+    new_enters_name = actual_leaving_via[0][-1]
+    new_enters_coord = new_left_coord + new_left_via
+
+    assert new_enters_name in wires_compass_map[new_enters_coord], (new_enters_name, wires_compass_map[new_enters_coord])
+
+    log.debug("%s %s %s", new_enters_via, new_enters_name, new_enters_coord)
+    return (new_left_coord, new_left_name, new_left_via, "-->", new_enters_via, new_enters_name, new_enters_coord)
+
+
+# (enters_coord, enters_name, enters_via, left_name) -> the next entry in the
+# trace (or a copy, without the traceback, of the AssertionError raised
+# working it out). Traces starting from
+# different wires share most of their path, so the rest of a trace is just
+# found by following the already cached entries.
+trace_steps = {}
+
+
 def trace_wire(wire_name, coord):
     assert_startname(wire_name)
 
@@ -461,51 +673,32 @@ def trace_wire(wire_name, coord):
     while True:
         left_coord, left_name, left_via, _, enters_via, enters_name, enters_coord = trace[-1]
 
-        print()
-        print(enters_via, enters_name, enters_coord)
-
-        possible_leaving_dirs = list(wires_compass_map[enters_coord][enters_name])
-        print("possible_leaving_dirs", possible_leaving_dirs, (enters_via, left_name))
-
-        enters_type = find_wire_type(enters_name, enters_coord, possible_leaving_dirs)
-        if enters_type == "START" or (enters_type == "LONGEND" and enters_via == START_STR):
-            assert_startname(enters_name)
-            assert len(possible_leaving_dirs) == 1, possible_leaving_dirs
-            assert enters_via == START_STR, (enters_via, trace[-1])
-        elif enters_type == "END" or (enters_type == "LONGEND" and enters_via != START_STR):
-            assert_endname(enters_name)
-            assert len(possible_leaving_dirs) == 1, possible_leaving_dirs
-            trace.append((enters_coord, enters_name, END_STR, "[ ]", '', '', ''))
-            break
-        elif enters_type == "LEAVES":
-            assert len(possible_leaving_dirs) == 1, possible_leaving_dirs
-            trace.append((enters_coord, enters_name, LEAVE_STR, "[ ]", '', '', ''))
-            break
-        elif enters_type == "PASS":
-            assert len(possible_leaving_dirs) == 2, possible_leaving_dirs
+        key = (enters_coord, enters_name, enters_via, left_name)
+        step = trace_steps.get(key, None)
+        if step is None:
+            try:
+                step = _trace_step(left_name, enters_via, enters_name, enters_coord)
+            except AssertionError as e:
+                # Don't keep e, its traceback would keep this trace alive.
+                step = AssertionError(*e.args)
+            trace_steps[key] = step
         else:
-            assert False, "Unknown wire type: %s (%s %s %s)" % (
-                    enters_type, enters_name, enters_coord, possible_leaving_dirs)
-
-        actual_leaving_via = [i for i in possible_leaving_dirs if i != (enters_via, left_name)]
-        print("   actual_leaving_via", actual_leaving_via)
-        assert len(actual_leaving_via) == 1, (possible_leaving_dirs, enters_via, actual_leaving_via)
+            lib.log.count("cached trace step")
 
-        new_left_coord = enters_coord
-        new_left_name = enters_name
-        new_left_via = actual_leaving_via[0][0]
-        new_enters_via = new_left_via.flip()
-        new_enters_name = actual_leaving_via[0][-1]
-        new_enters_coord = new_left_coord + new_left_via
+        if isinstance(step, AssertionError):
+            # Raise a new exception each time, re-raising the cached one
+            # would grow its traceback (and keep every failed trace alive).
+            raise AssertionError(*step.args)
 
-        assert new_enters_name in wires_compass_map[new_enters_coord], (new_enters_name, wires_compass_map[new_enters_coord])
-
-        print(new_enters_via, new_enters_name, new_enters_coord)
-        trace.append((new_left_coord, new_left_name, new_left_via, "-->", new_enters_via, new_enters_name, new_enters_coord))
+        trace.append(step)
+        if step[2] in (END_STR, LEAVE_STR):
+            break
 
     return trace
 
-routing_nodes = open("routing.txt", "w")
+routing_nodes = None
+if args.routing_trace:
+    routing_nodes = open(args.routing_trace, "w")
 
 class WireDecoder:
     SHORT_REGEX = re.compile("(..)([0-9])(BEG|END)([0-9])")
@@ -517,39 +710,47 @@ class WireDecoder:
     }
 
 
-wires = []
-for y in range(grid_min[1], grid_max[1]+1):
+# Formatting the traces is slow, so only do it if they are going to be output.
+output_traces = routing_nodes is not None or log.isEnabledFor(logging.DEBUG)
 
-    if y < args.start_y or y > args.end_y:
-        continue
 
+def trace_row(y):
+    """Trace all the wires starting in row y.
+
+    Only reads the global state, so can be run in a forked worker process.
+    Returns the wires found, the trace output, the (wire, coord, error) for
+    each trace which failed and the number of traces.
+    """
+    row_wires = []
+    output = []
+    failed = []
+    traced = 0
     for x in range(grid_min[0], grid_max[0]+1):
 
-        if x < args.start_x or x > args.end_x:
+        if x < region[0][0] or x > region[1][0]:
             continue
 
         coord = (x, y)
 
-        print("================================")
         if not wires_start_map[coord]:
-            print("No routing nodes starting in %s (%s)" % (coord, grid[coord]))
-            routing_nodes.write("No routing nodes starting in %s (%s)\n" % (coord, grid[coord]))
-            routing_nodes.write("-"*75)
-            routing_nodes.write("\n")
+            if output_traces:
+                output.append("No routing nodes starting in %s (%s)\n" % (coord, grid[coord]))
+                output.append("-"*75)
+                output.append("\n")
             continue
 
         for w in sorted(wires_start_map[coord]):
-            print("Starting to trace %s from %s" % (w, coord))
+            log.debug("Starting to trace %s from %s", w, coord)
             try:
                 t = trace_wire(w, coord)
             except AssertionError as e:
-                print("ERROR:", "Issue tracing %s from %s" % (w, coord), str(e))
+                failed.append((w, coord, str(e)))
                 continue
-            print()
-            print("SUCCESS!")
-            print("-"*75)
+            traced += 1
 
-            s = ["Trace for %s from %s (%s)\n" % (w, coord, grid[coord])]
+            s = []
+            if output_traces:
+                s.append("Trace for %s from %s (%s)\n" % (w, coord, grid[coord]))
             route = []
             for a in t:
                 route.append((a[-1], a[-2]))
@@ -566,44 +767,74 @@ for y in range(grid_min[1], grid_max[1]+1):
                         a = (a[0], a[1], LEAVE_STR, '[ ]', '', '', a[-1])
                     end = grid[a[-1]]
 
-                s.append("%15s" % start)
-                s.append("%8s %30s %15s %s %-15s %-30s %-8s" % a)
-                s.append("%-15s\n" % end)
+                if output_traces:
+                    s.append("%15s" % start)
+                    s.append("%8s %30s %15s %s %-15s %-30s %-8s" % a)
+                    s.append("%-15s\n" % end)
 
                 if a[2] == LEAVE_STR:
                     route = None
                     break
 
                 elif a[2] == END_STR:
-                    wires.append(route[:-1])
+                    row_wires.append(route[:-1])
                     break
 
+            if output_traces:
+                s.append("-"*75)
+                s.append("\n")
+                output.append("".join(s))
+
+    return row_wires, "".join(output), failed, traced
+
+
+lib.log.start_phase(log, "Tracing wires")
+if args.read_partials:
+    # The wires were traced when the partial graphs were generated.
+    rows = []
+else:
+    rows = [y for y in range(grid_min[1], grid_max[1]+1) if region[0][1] <= y <= region[1][1]]
+
+if args.jobs > 1:
+    # The workers are forked so they share the (read only) grid and
+    # wires_compass_map. Each worker gets a band of rows at a time and imap
+    # returns the results in row order, so the wires (and hence the rr_graph)
+    # are the same as the single process version.
+    import multiprocessing
+    pool = multiprocessing.get_context("fork").Pool(args.jobs)
+    band = max(1, len(rows) // (args.jobs * 4))
+    row_results = pool.imap(trace_row, rows, chunksize=band)
+else:
+    pool = None
+    row_results = map(trace_row, rows)
 
-            s.append("-"*75)
-            s.append("\n")
-            s = "".join(s)
-            print(s)
-            routing_nodes.write(s)
-
-print("\n"*4)
+wires = []
+for row_wires, output, failed, traced in row_results:
+    wires.extend(row_wires)
+    for w, coord, e in failed:
+        log.warning("ERROR: Issue tracing %s from %s %s", w, coord, e)
+    lib.log.count("trace", traced)
+    lib.log.count("failed trace", len(failed))
+    if output:
+        log.debug("%s", output)
+        if routing_nodes is not None:
+            routing_nodes.write(output)
 
-print(len(wires), "routing nodes found")
-pprint.pprint(wires)
+if pool is not None:
+    pool.close()
+    pool.join()
 
+if routing_nodes is not None:
+    routing_nodes.close()
 
-import lxml.etree as ET
+log.info("%s routing nodes found", len(wires))
+log.debug("%s", LazyPFormat(wires))
 
-# Read in existing file
-rr_graph = ET.parse(args.read_rr_graph)
 
-# Delete the nodes and edges
-for nodes in rr_graph.iterfind("rr_nodes"):
-    for n in list(nodes):
-        nodes.remove(n)
-for edges in rr_graph.iterfind("rr_edges"):
-    for e in list(edges):
-        edges.remove(e)
-    edges.clear()
+# Read in existing file, skipping the nodes and edges as they are regenerated
+# by the GraphStore below.
+lib.log.start_phase(log, "Reading rr_graph")
+rr_graph = read_sections(args.read_rr_graph)
 
 # Create in the block_types information
 blocktype_pins = {}
@@ -619,38 +850,22 @@ for block_type in rr_graph.iterfind("./block_types/block_type"):
         pin_name = pin.text.strip()
         blocktype_pins[block_name][pin_name] = (pin_ptc, pin.getparent().attrib["type"])
 
-pprint.pprint(blocktype_pins)
-
-
-# Mapping dictionaries
-globalname2node = {}
-globalname2nodeid = {}
-
-
-def add_node(globalname, attribs):
-    """Add node with globalname and attributes."""
-    # Add common attributes
-    attribs['capacity'] =  str(1)
+log.debug("%s", LazyPFormat(blocktype_pins))
 
-    # Work out the ID for this node and add to the mapping
-    assert len(globalname2node) == len(globalname2nodeid)
 
-    attribs['id'] = str(len(globalname2node))
+# The nodes and edges, only converted to XML when the file is written.
+if partial is not None:
+    graph = partial.graph
+else:
+    graph = GraphStore()
 
-    node = ET.SubElement(nodes, 'node', attribs)
 
-    # Stash in the mappings
-    assert globalname not in globalname2node, globalname
-    assert globalname not in globalname2nodeid, globalname
+def add_node(globalname, nodetype, start, end, ptc, **kw):
+    """Add node with globalname and return the node id.
 
-    globalname2node[globalname] = node
-    globalname2nodeid[globalname] = attribs['id']
-
-    # Add some helpful comments
-    if args.verbose:
-        node.append(ET.Comment(" {} ".format(globalname)))
-
-    return node
+    See `GraphStore.add_node` for the other attributes.
+    """
+    return graph.add_node(globalname, nodetype, start, end, ptc, **kw)
 
 
 def globalname(pos, name):
@@ -658,21 +873,11 @@ def globalname(pos, name):
 
 
 def add_edge(src_globalname, dst_globalname):
-    src_node_id = globalname2nodeid[src_globalname]
-    dst_node_id = globalname2nodeid[dst_globalname]
-
-    attribs = {
-        'src_node': str(src_node_id),
-        'sink_node': str(dst_node_id),
-        'switch_id': str(0),
-    }
-    e = ET.SubElement(edges, 'edge', attribs)
-
-    # Add some helpful comments
-    if args.verbose:
-        e.append(ET.Comment(" {} -> {} ".format(src_globalname, dst_globalname)))
-        globalname2node[src_globalname].append(ET.Comment(" this -> {} ".format(dst_globalname)))
-        globalname2node[dst_globalname].append(ET.Comment(" {} -> this ".format(src_globalname)))
+    if partial is not None:
+        # The other end could be in a different region.
+        partial.add_edge(src_globalname, dst_globalname, 0)
+        return
+    graph.add_edge(graph.node_id(src_globalname), graph.node_id(dst_globalname), 0)
 
 
 def add_pin(pos, pin_globalname, pin_idx, pin_dir):
@@ -696,17 +901,7 @@ def add_pin(pos, pin_globalname, pin_idx, pin_dir):
 
     if pin_dir in ("INPUT", "CLOCK"):
         # Pin node
-        attribs = {
-            'type': 'IPIN',
-        }
-        node = add_node(pin_globalname, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(low[0]), 'ylow': str(low[1]),
-            'xhigh': str(high[0]), 'yhigh': str(high[1]),
-            'ptc': str(pin_idx),
-            'side': 'TOP',
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        add_node(pin_globalname, 'IPIN', low, high, pin_idx, side='TOP', timing=(0, 0))
 
         # Sink node
         if "INT_R" in pin_globalname:
@@ -714,33 +909,14 @@ def add_pin(pos, pin_globalname, pin_idx, pin_dir):
         elif "INT_L" in pin_globalname:
             high[0]+=1
 
-        attribs = {
-            'type': 'SINK',
-        }
-        node = add_node(pin_globalname_a, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(low[0]), 'ylow': str(low[1]),
-            'xhigh': str(high[0]), 'yhigh': str(high[1]),
-            'ptc': str(pin_idx),
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        add_node(pin_globalname_a, 'SINK', low, high, pin_idx, timing=(0, 0))
 
         # Edge PIN->SINK
         add_edge(pin_globalname, pin_globalname_a)
 
     elif pin_dir in ("OUTPUT",):
         # Pin node
-        attribs = {
-            'type': 'OPIN',
-        }
-        node = add_node(pin_globalname, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(low[0]), 'ylow': str(low[1]),
-            'xhigh': str(high[0]), 'yhigh': str(high[1]),
-            'ptc': str(pin_idx),
-            'side': 'TOP',
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        add_node(pin_globalname, 'OPIN', low, high, pin_idx, side='TOP', timing=(0, 0))
 
         # Source node
         if "INT_R" in pin_globalname:
@@ -748,16 +924,7 @@ def add_pin(pos, pin_globalname, pin_idx, pin_dir):
         elif "INT_L" in pin_globalname:
             high[0]+=1
 
-        attribs = {
-            'type': 'SOURCE',
-        }
-        node = add_node(pin_globalname_a, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(low[0]), 'ylow': str(low[1]),
-            'xhigh': str(high[0]), 'yhigh': str(high[1]),
-            'ptc': str(pin_idx),
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        add_node(pin_globalname_a, 'SOURCE', low, high, pin_idx, timing=(0, 0))
 
         # Edge SOURCE->PIN
         add_edge(pin_globalname_a, pin_globalname)
@@ -765,16 +932,50 @@ def add_pin(pos, pin_globalname, pin_idx, pin_dir):
     else:
         assert False, "Unknown dir of {} for {}".format(pin_dir, pin_globalname)
 
-    print("Adding pin {:55s} on tile ({:3d}, {:3d})@{:4d}".format(pin_globalname, pos[0], pos[1], pin_idx))
+    log.debug("Adding pin %-55s on tile (%3d, %3d)@%4d", pin_globalname, pos[0], pos[1], pin_idx)
+    lib.log.count("pin")
 
 
-def add_channel_filler(pos, chantype):
+def add_channel_filler(pos, chantype, track=None):
+    """Add a filler node on track (by default a new one) of the channel at pos."""
     x,y = pos
-    current_len = len(channels[chantype][(x,y)])
-    fillername = "{}-{},{}+{}-filler".format(chantype,x,y,current_len)
-    add_channel(fillername, pos, pos, '0', _chantype=chantype)
-    new_len = len(channels[chantype][(x,y)])
-    assert current_len + 1 == new_len, new_len
+    tracks = channels[chantype][(x,y)]
+    if track is None:
+        track = len(tracks)
+        tracks.append(None)
+    assert tracks[track] is None, (pos, chantype, track, tracks[track])
+
+    fillername = "{}-{},{}+{}-filler".format(chantype,x,y,track)
+    tracks[track] = fillername
+    add_node(fillername, chantype, pos, pos, track, direction="INC_DIR", segment=0)
+
+    log.debug("Adding channel filler %s", fillername)
+    lib.log.count("filler")
+
+
+def allocate_track(globalname, chantype, start, end, pad=True):
+    """Allocate the track (ptc) for a channel running from start to end.
+
+    The channel gets the first track which is free at every position, the
+    positions with fewer tracks in use are padded with fillers unless pad is
+    False.
+    """
+    x_start, y_start = start
+    x_end, y_end = end
+    channels_for_type = channels[chantype]
+
+    idx = 0
+    for x in range(x_start, x_end+1):
+        for y in range(y_start, y_end+1):
+            idx = max(idx, len(channels_for_type[(x,y)]))
+
+    for x in range(x_start, x_end+1):
+        for y in range(y_start, y_end+1):
+            while len(channels_for_type[(x,y)]) < idx and pad:
+                add_channel_filler((x,y), chantype)
+            channels_for_type[(x,y)].append(globalname)
+
+    return idx
 
 
 def add_channel(globalname, start, end, segtype, _chantype=None):
@@ -816,40 +1017,30 @@ def add_channel(globalname, start, end, segtype, _chantype=None):
     else:
         assert False, (globalname, start, end, segtype, _chantype)
 
-    attribs = {
-        'direction': chandir,
-        'type': chantype,
-    }
-    node = add_node(globalname, attribs)
-
     # <loc xlow="int" ylow="int" xhigh="int" yhigh="int" side="{LEFT|RIGHT|TOP|BOTTOM}" ptc="int">
-    channels_for_type = channels[chantype]
-
-    idx = 0
-    for x in range(x_start, x_end+1):
-        for y in range(y_start, y_end+1):
-            idx = max(idx, len(channels_for_type[(x,y)]))
-
-    for x in range(x_start, x_end+1):
-        for y in range(y_start, y_end+1):
-            while len(channels_for_type[(x,y)]) < idx and _chantype == None:
-                add_channel_filler((x,y), chantype)
-            channels_for_type[(x,y)].append(globalname)
-
     # xlow, xhigh, ylow, yhigh - Integer coordinates of the ends of this routing source.
     # ptc - This is the pin, track, or class number that depends on the rr_node type.
 
     # side - { LEFT | RIGHT | TOP | BOTTOM }
     # For IPIN and OPIN nodes specifies the side of the grid tile on which the node
     # is located. Purely cosmetic?
-    ET.SubElement(node, 'loc', {
-        'xlow': str(x_start), 'ylow': str(y_start),
-        'xhigh': str(x_end), 'yhigh': str(y_end),
-        'ptc': str(idx),
-    })
-    ET.SubElement(node, 'segment', {'segment_id': str(segtype)})
-
-    print("Adding channel {} from {} -> {} pos {}".format(globalname, start, end, idx))
+
+    # The node is added before allocating the track, so it comes before any
+    # fillers the allocation adds.
+    node_id = add_node(
+        globalname, chantype, start, end, 0,
+        direction=chandir, segment=int(segtype))
+
+    if partial is not None or args.compact_channels:
+        # The tracks are allocated once all the channels are known (and the
+        # partial graphs of all the regions are stitched together).
+        idx = 0
+    else:
+        idx = allocate_track(globalname, chantype, start, end, pad=_chantype is None)
+        graph.ptc[node_id] = idx
+
+    log.debug("Adding channel %s from %s -> %s pos %s", globalname, start, end, idx)
+    lib.log.count("channel")
     return globalname, globalname
 
 
@@ -867,6 +1058,63 @@ def vpr_map_y(y):
 def vpr_map_pos(pos):
     return (vpr_map_x(pos[0]), vpr_map_y(pos[1]))
 
+
+def channel_positions(chantype, common, start, end):
+    """Positions a channel from start to end along row / column common covers."""
+    if chantype == 'CHANX':
+        return [(i, common) for i in range(start, end+1)]
+    else:
+        return [(common, i) for i in range(start, end+1)]
+
+
+def compact_channels():
+    """Allocate the channel tracks by packing each row / column of channels.
+
+    Unlike `allocate_track` no fillers are needed while allocating, and the
+    number of tracks in each row / column is the most channels overlapping at
+    any position. Returns the number of fillers `allocate_track` would have
+    needed, for comparison.
+    """
+    lines = {}
+    for node_id in range(len(graph)):
+        name, node_type, low, high = graph.node(node_id)[:4]
+        if node_type == 'CHANX':
+            line, interval = (node_type, low[1]), (low[0], high[0])
+        elif node_type == 'CHANY':
+            line, interval = (node_type, low[0]), (low[1], high[1])
+        else:
+            continue
+        lines.setdefault(line, []).append((node_id, interval))
+
+    for (chantype, common), line in sorted(lines.items()):
+        tracks = pack_tracks([interval for node_id, interval in line])
+        for (node_id, (start, end)), track in zip(line, tracks):
+            graph.ptc[node_id] = track
+            for pos in channel_positions(chantype, common, min(start, end), max(start, end)):
+                pos_tracks = channels[chantype][pos]
+                if len(pos_tracks) <= track:
+                    pos_tracks.extend([None] * (track + 1 - len(pos_tracks)))
+                pos_tracks[track] = graph.id2name[node_id]
+        lib.log.count("channel", len(line))
+
+    # Replay the allocation done by allocate_track (in the same node order)
+    # to find how many fillers it needs.
+    old_fillers = 0
+    for chantype in channels:
+        lengths = {pos: 0 for pos in channels[chantype]}
+        for (line_type, common), line in lines.items():
+            if line_type != chantype:
+                continue
+            for node_id, (start, end) in line:
+                positions = channel_positions(chantype, common, start, end)
+                idx = max([lengths[pos] for pos in positions], default=0)
+                for pos in positions:
+                    old_fillers += idx - lengths[pos]
+                    lengths[pos] = idx + 1
+        width = max(lengths.values(), default=0)
+        old_fillers += sum(width - l for l in lengths.values())
+    return old_fillers
+
 channels = {'CHANX': {}, 'CHANY': {}}
 for x in range(args.start_x, args.end_x+1):
     for y in range(args.start_y, args.end_y+1):
@@ -875,8 +1123,14 @@ for x in range(args.start_x, args.end_x+1):
         channels['CHANY'][(vx,vy)] = []
 
 
-for i, x in enumerate(range(args.start_x, args.end_x+1)):
-    for j, y in enumerate(range(args.start_y, args.end_y+1)):
+lib.log.start_phase(log, "Adding pins")
+if args.read_partials:
+    # The pins are already in the partial graphs.
+    pin_xs = []
+else:
+    pin_xs = range(region[0][0], region[1][0]+1)
+for i, x in enumerate(pin_xs):
+    for j, y in enumerate(range(region[0][1], region[1][1]+1)):
         pos = (x,y)
         tile_type = grid[pos]
 
@@ -891,6 +1145,7 @@ for i, x in enumerate(range(args.start_x, args.end_x+1)):
             add_pin(vpr_map_pos(pos), pin_globalname, pin_idx, pin_dir)
 
 
+lib.log.start_phase(log, "Adding channels")
 for w in wires:
     start = w[0]
     name, x, index = re.match("^(..[0-9]*)(.*)([0-9]+)$", start[-1]).groups()
@@ -908,10 +1163,10 @@ for w in wires:
         names.append(globalname(pos, name))
 
     wire_global_name = "->>".join(names)
-    print()
-    print(wire_global_name)
+    log.debug("%s", wire_global_name)
     if "LV" in wire_global_name or "LH" in wire_global_name:
-        print("Skipping")
+        log.debug("Skipping")
+        lib.log.count("skipped long wire")
         continue
 
     start_pos = w[0][0]
@@ -923,6 +1178,37 @@ for w in wires:
     add_edge(end_channelname, globalname(end_pos, w[-1][-1]))
 
 
+if partial is not None:
+    lib.log.start_phase(log, "Writing partial graph")
+    partial.save(args.write_partial)
+    lib.log.end_phase(log)
+    log.info("Wrote %s nodes, %s edges and %s stubs to %s",
+        len(graph), graph.num_edges, len(partial.stubs), args.write_partial)
+    sys.exit(0)
+
+
+if args.read_partials:
+    lib.log.start_phase(log, "Stitching partial graphs")
+    partials = [PartialGraph.load(f) for f in args.read_partials]
+    for p in partials:
+        log.debug("Partial graph for %s has %s nodes and %s stubs", p.region, len(p.graph), len(p.stubs))
+        lib.log.count("partial graph")
+    stitch(partials, graph)
+
+old_fillers = None
+if args.compact_channels:
+    lib.log.start_phase(log, "Compacting channel tracks")
+    old_fillers = compact_channels()
+elif args.read_partials:
+    lib.log.start_phase(log, "Allocating channel tracks")
+    for node_id in range(len(graph)):
+        name, node_type, low, high = graph.node(node_id)[:4]
+        if node_type not in channels:
+            continue
+        graph.ptc[node_id] = allocate_track(name, node_type, low, high)
+        lib.log.count("channel")
+
+
 # Work out how wide each channel is going to be...
 channel_count = {'CHANY': {}, 'CHANX': {}}
 channel_max_width = {'CHANY': 0, 'CHANX': 0}
@@ -932,14 +1218,26 @@ for i in 'CHANY', 'CHANX':
         channel_max_width[i] = max(channel_max_width[i], channel_count[i][(x,y)])
 
 
-print("Max channels")
-pprint.pprint(channel_count)
-print(channel_max_width)
+log.debug("Max channels")
+log.debug("%s", LazyPFormat(channel_count))
+log.info("Max channel width %s", channel_max_width)
+lib.log.start_phase(log, "Adding channel fillers")
+nodes_before_fillers = len(graph)
 for i in ['CHANY', 'CHANX']:
     for x,y in sorted(channels[i]):
+        # Tracks left unused by compact_channels
+        for track, name in enumerate(channels[i][(x,y)]):
+            if name is None:
+                add_channel_filler((x,y), i, track)
+
         while len(channels[i][(x,y)]) < channel_max_width[i]:
             add_channel_filler((x,y), i)
 
+if old_fillers is not None:
+    lib.log.end_phase(log)
+    log.info("Compacting the channels needed %s filler nodes rather than %s",
+        len(graph) - nodes_before_fillers, old_fillers)
+
 channel = rr_graph.findall('.//channel')[0]
 #assert "chan_width_max" in channel.attrib
 #assert "x_min" in channel.attrib
@@ -961,7 +1259,9 @@ channel = rr_graph.findall('.//channel')[0]
 #    index = int(n.attrib["index"])
 #    if (index, -1) in channel_count:
 
-pprint.pprint(channels)
+log.debug("%s", LazyPFormat(channels))
 
-with open(args.write_rr_graph, "wb") as f:
-    rr_graph.write(f, pretty_print=True)
+lib.log.start_phase(log, "Writing rr_graph")
+graph.write(args.write_rr_graph, rr_graph.getroot(), comments=args.verbose)
+lib.log.end_phase(log)
+log.info("Wrote %s nodes and %s edges to %s", len(graph), graph.num_edges, args.write_rr_graph)
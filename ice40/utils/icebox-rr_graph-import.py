@@ -51,16 +51,29 @@ which are multiple tiles wide in the Y direction.
 For each wire, we work out the "edges" (IE connection to other wires / pins).
 """
 
+import os
 from os.path import commonprefix
 
 import icebox
 import getopt, sys, re
 
+import hashlib
+import inspect
+import logging
+import pickle
+import tempfile
+
 import operator
+from array import array
 from collections import namedtuple, OrderedDict
 from functools import reduce
 import lxml.etree as ET
 
+mydir = os.path.dirname(__file__)
+sys.path.insert(0, os.path.join(mydir, "..", "..", "utils"))
+from lib.rr_graph.store import GraphStore
+import lib.log
+
 mode_384 = False
 mode_5k = False
 mode_8k = False
@@ -77,13 +90,37 @@ Usage: icebox_chipdb [options] [bitmap.asc]
 
     -8
         create chipdb for 8k device
+
+    -j N
+        generate the edges using N processes
+
+    -n
+        don't read or write the cache of calculated nets
+
+    -c FILE
+        cache the calculated nets in FILE (default icebox-nets-<device>.pickle)
+
+    -v
+        output a message for every object created (rather than just a summary
+        of each step)
+
+    -q
+        only output warnings
+
+    -l FILE
+        write every message to FILE as JSON lines
 """)
     sys.exit(0)
 
 VERBOSE=True
+JOBS=1
+NETS_CACHE=True
+NETS_CACHE_FILE=None
+LOG_VERBOSITY=0
+LOG_JSON=None
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "358")
+    opts, args = getopt.getopt(sys.argv[1:], "358j:nc:vql:")
 except:
     usage()
 
@@ -98,9 +135,23 @@ for o, a in opts:
     elif o == "-3":
         mode_384 = True
         device_name = '384'
+    elif o == "-j":
+        JOBS = int(a)
+    elif o == "-n":
+        NETS_CACHE = False
+    elif o == "-c":
+        NETS_CACHE_FILE = a
+    elif o == "-v":
+        LOG_VERBOSITY += 1
+    elif o == "-q":
+        LOG_VERBOSITY -= 1
+    elif o == "-l":
+        LOG_JSON = a
     else:
         usage()
 
+log = lib.log.setup("icebox-rr_graph-import", LOG_VERBOSITY, LOG_JSON)
+
 ic = icebox.iceconfig()
 if mode_8k:
     ic.setup_empty_8k()
@@ -137,6 +188,10 @@ class GlobalName(tuple):
     def __init__(self, *args, **kw):
         pass
 
+    def __getnewargs__(self):
+        # Needed for pickle as __new__ takes the items as separate arguments.
+        return tuple(self)
+
 
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
@@ -152,6 +207,10 @@ rr_graph = ET.Element(
     dict(tool_name="icebox", tool_version="???", tool_comment="Generated for iCE40 {} device".format(device_name)),
 )
 
+# The nodes and edges are kept in a compact store and only converted to XML
+# when the rr_graph.xml file is written.
+graph = GraphStore()
+
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
@@ -250,47 +309,76 @@ for sid, (name, attrib) in enumerate(segment_types.items()):
     segment_types[name] = sid
     ET.SubElement(seg, 'timing', {'R_per_meter': "101", 'C_per_meter':"1.10e-14"})
 
+# The nodes and edges are written by graph.write(), these empty elements mark
+# where they go so the sections are in the same order as always.
+ET.SubElement(rr_graph, 'rr_nodes')
+ET.SubElement(rr_graph, 'rr_edges')
+
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
 
+# Interned global names
+# Each distinct GlobalName is given a small integer id (its index in
+# `globalnames`) the first time it is seen. The mappings below are keyed by
+# these ids, so the global names (nested tuples, which don't cache their
+# hash) are only hashed once rather than on every lookup.
+globalname_ids = {}
+globalnames = []
+
+# Global name id -> node id (or -1 if there is no node for the name).
+# The nodes are stored in the graph under their global name id rather than
+# the GlobalName, so only `globalname_ids` is keyed by GlobalName.
+globalname_nodeids = array('i')
+
+def globalname_id(globalname):
+    """Get the integer id of globalname, allocating one if needed."""
+    gid = globalname_ids.get(globalname, None)
+    if gid is None:
+        assert isinstance(globalname, GlobalName), "{!r} must be a GlobalName".format(globalname)
+        gid = len(globalnames)
+        globalname_ids[globalname] = gid
+        globalnames.append(globalname)
+        globalname_nodeids.append(-1)
+    return gid
+
+
 # Mapping dictionaries
+# Global name id -> list of the (pos, localname) aliases for it
 globalname2netnames = {}
-globalname2node = {}
-globalname2nodeid = {}
 
-netname2globalname = {}
+# TilePos -> {localname: global name id}
+tile_netnames = {}
 
 def add_globalname2localname(globalname, pos, localname):
     global globalname2netnames
 
     assert isinstance(globalname, GlobalName), "{!r} must be a GlobalName".format(globalname)
-    assert isinstance(pos, TilePos), "{!r} must be a TilePos".format(tilepos)
+    assert isinstance(pos, TilePos), "{!r} must be a TilePos".format(pos)
 
-    nid = (pos, localname)
+    gid = globalname_id(globalname)
 
-    if nid in netname2globalname:
-        assert globalname == netname2globalname[nid], (
+    netnames = tile_netnames.setdefault(pos, {})
+    if localname in netnames:
+        assert gid == netnames[localname], (
             "While adding global name {} found existing global name {} for {}".format(
-                globalname, netname2globalname[nid], nid))
+                globalname, globalnames[netnames[localname]], (pos, localname)))
+        log.debug("Existing alias for %s is tile %s - %s", globalname, pos, localname)
         return
 
-    netname2globalname[nid] = globalname
-    if globalname not in globalname2netnames:
-        globalname2netnames[globalname] = set()
-
-    if nid not in globalname2netnames[globalname]:
-        globalname2netnames[globalname].add(nid)
-        print("Adding alias for {} is tile {} - {}".format(globalname, pos, localname))
-    else:
-        print("Existing alias for {} is tile {} - {}".format(globalname, pos, localname))
+    netnames[localname] = gid
+    globalname2netnames.setdefault(gid, []).append((pos, localname))
+    log.debug("Adding alias for %s is tile %s - %s", globalname, pos, localname)
+    lib.log.count("alias")
 
 
 def localname2globalname(pos, localname, default=None):
     """Convert from a local name to a globally unique name."""
-    assert isinstance(pos, TilePos), "{!r} must be a TilePos".format(tilepos)
-    nid = (pos, localname)
-    return netname2globalname.get(nid, default)
+    assert isinstance(pos, TilePos), "{!r} must be a TilePos".format(pos)
+    gid = tile_netnames.get(pos, {}).get(localname, None)
+    if gid is None:
+        return default
+    return globalnames[gid]
 
 
 # -----------------------------------------------------------------------
@@ -348,59 +436,28 @@ def localname2globalname(pos, localname, default=None):
 		</node>
 """
 
-nodes = ET.SubElement(rr_graph, 'rr_nodes')
-def add_node(globalname, attribs):
-    """Add node with globalname and attributes."""
-    assert isinstance(globalname, GlobalName), "{!r} should be a GlobalName".format(globalname)
-
-    # Add common attributes
-    attribs['capacity'] =  str(1)
-
-    # Work out the ID for this node and add to the mapping
-    attribs['id'] = str(len(globalname2node))
-
-    node = ET.SubElement(nodes, 'node', attribs)
+def add_node(globalname, nodetype, start, end, ptc, **kw):
+    """Add node with globalname and return the node id.
 
-    # Stash in the mappings
-    assert globalname not in globalname2node
-    assert globalname not in globalname2nodeid
-    globalname2node[globalname] = node
-    globalname2nodeid[globalname] = attribs['id']
-
-    # Add some helpful comments
-    if VERBOSE:
-        node.append(ET.Comment(" {} ".format(globalname)))
-
-    return node
+    See `GraphStore.add_node` for the other attributes.
+    """
+    assert isinstance(globalname, GlobalName), "{!r} should be a GlobalName".format(globalname)
+    gid = globalname_id(globalname)
+    node_id = graph.add_node(gid, nodetype, start, end, ptc, **kw)
+    globalname_nodeids[gid] = node_id
+    return node_id
 
 
 # Edges -----------------------------------------------------------------
 
-edges = ET.SubElement(rr_graph, 'rr_edges')
-def add_edge(src_globalname, dst_globalname, bidir=False):
+def add_edge(src_nodeid, dst_nodeid, bidir=False):
+    """Add an edge between the node ids returned by `add_node`."""
     if bidir:
-        add_edge(src_globalname, dst_globalname)
-        add_edge(dst_globalname, src_globalname)
+        add_edge(src_nodeid, dst_nodeid)
+        add_edge(dst_nodeid, src_nodeid)
         return
 
-    assert isinstance(src_globalname, GlobalName), "src {!r} should be a GlobalName".format(src_globalname)
-    assert isinstance(dst_globalname, GlobalName), "dst {!r} should be a GlobalName".format(dst_globalname)
-
-    src_node_id = globalname2nodeid[src_globalname]
-    dst_node_id = globalname2nodeid[dst_globalname]
-
-    attribs = {
-        'src_node': str(src_node_id),
-        'sink_node': str(dst_node_id),
-        'switch_id': str(0),
-    }
-    e = ET.SubElement(edges, 'edge', attribs)
-
-    # Add some helpful comments
-    if VERBOSE:
-        e.append(ET.Comment(" {} -> {} ".format(src_globalname, dst_globalname)))
-        globalname2node[src_globalname].append(ET.Comment(" this -> {} ".format(dst_globalname)))
-        globalname2node[dst_globalname].append(ET.Comment(" {} -> this ".format(src_globalname)))
+    graph.add_edge(src_nodeid, dst_nodeid, 0)
 
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
@@ -449,12 +506,6 @@ def add_channel(globalname, nodetype, start, end, idx, segtype):
         channels[channel][idx] = []
     channels[channel][idx].append(globalname)
 
-    attribs = {
-        'direction': 'BI_DIR',
-        'type': nodetype,
-    }
-    node = add_node(globalname, attribs)
-
     # <loc xlow="int" ylow="int" xhigh="int" yhigh="int" side="{LEFT|RIGHT|TOP|BOTTOM}" ptc="int">
 
     # xlow, xhigh, ylow, yhigh - Integer coordinates of the ends of this routing source.
@@ -463,14 +514,12 @@ def add_channel(globalname, nodetype, start, end, idx, segtype):
     # side - { LEFT | RIGHT | TOP | BOTTOM }
     # For IPIN and OPIN nodes specifies the side of the grid tile on which the node
     # is located. Purely cosmetic?
-    ET.SubElement(node, 'loc', {
-        'xlow': str(x_start), 'ylow': str(y_start),
-        'xhigh': str(x_end), 'yhigh': str(y_end),
-        'ptc': str(idx),
-    })
-    ET.SubElement(node, 'segment', {'segment_id': str(segtype)})
+    add_node(
+        globalname, nodetype, start, end, idx,
+        direction='BI_DIR', segment=segment_types[segtype])
 
-    print("Adding channel {} from {} -> {} pos {}".format(globalname, start, end, idx))
+    log.debug("Adding channel %s from %s -> %s pos %s", globalname, start, end, idx)
+    lib.log.count("channel")
 
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
@@ -539,66 +588,29 @@ def add_pin(pos, localname, dir, idx):
 
     if dir == "out":
         # Sink node
-        attribs = {
-            'type': 'SINK',
-        }
-        node = add_node(gname, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(vpos[0]), 'ylow': str(vpos[1]),
-            'xhigh': str(vpos[0]), 'yhigh': str(vpos[1]),
-            'ptc': str(idx),
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        sink_id = add_node(gname, 'SINK', vpos, vpos, idx, timing=(0, 0))
 
         # Pin node
-        attribs = {
-            'type': 'IPIN',
-        }
-        node = add_node(gname_pin, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(vpos[0]), 'ylow': str(vpos[1]),
-            'xhigh': str(vpos[0]), 'yhigh': str(vpos[1]),
-            'ptc': str(idx),
-            'side': 'TOP',
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        pin_id = add_node(gname_pin, 'IPIN', vpos, vpos, idx, side='TOP', timing=(0, 0))
 
         # Edge between pin node
-        add_edge(gname, gname_pin)
+        add_edge(sink_id, pin_id)
 
     elif dir == "in":
         # Source node
-        attribs = {
-            'type': 'SOURCE',
-        }
-        node = add_node(gname, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(vpos[0]), 'ylow': str(vpos[1]),
-            'xhigh': str(vpos[0]), 'yhigh': str(vpos[1]),
-            'ptc': str(idx),
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        source_id = add_node(gname, 'SOURCE', vpos, vpos, idx, timing=(0, 0))
 
         # Pin node
-        attribs = {
-            'type': 'OPIN',
-        }
-        node = add_node(gname_pin, attribs)
-        ET.SubElement(node, 'loc', {
-            'xlow': str(vpos[0]), 'ylow': str(vpos[1]),
-            'xhigh': str(vpos[0]), 'yhigh': str(vpos[1]),
-            'ptc': str(idx),
-            'side': 'TOP',
-        })
-        ET.SubElement(node, 'timing', {'R': str(0), 'C': str(0)})
+        pin_id = add_node(gname_pin, 'OPIN', vpos, vpos, idx, side='TOP', timing=(0, 0))
 
         # Edge between pin node
-        add_edge(gname_pin, gname)
+        add_edge(pin_id, source_id)
 
     else:
         assert False, "Unknown dir of {} for {}".format(dir, gname)
 
-    print("Adding pin {} on tile {}@{}".format(gname, pos, idx))
+    log.debug("Adding pin %s on tile %s@%s", gname, pos, idx)
+    lib.log.count("pin")
 
 
 # -----------------------------------------------------------------------
@@ -672,7 +684,8 @@ def add_track_gbl2local(pos, i):
     idx = LOCAL_TRACKS_MAX_GROUPS * (LOCAL_TRACKS_PER_GROUP) + i
 
     #print("Adding glb2local {} track {} on tile {}@{}".format(i, gname, pos, idx))
-    add_channel(gname, 'CHANY', pos, pos, idx, 'gbl2local')
+    # glb2local tracks are local routing, so use the local segment type.
+    add_channel(gname, 'CHANY', pos, pos, idx, 'local')
     add_globalname2localname(gname, pos, lname)
 
 
@@ -880,9 +893,7 @@ tile_types = {
     },
 }
 
-print()
-print("Generate tiles types")
-print("="*75)
+lib.log.start_phase(log, "Generate tiles types")
 
 """
     <block_types>
@@ -899,7 +910,8 @@ print("="*75)
 tt = ET.SubElement(rr_graph, 'block_types')
 
 for tile_name, tile_desc in tile_types.items():
-    print("{}".format(tile_name))
+    log.debug("%s", tile_name)
+    lib.log.count("block_type")
     tile = ET.SubElement(
         tt, 'block_type',
         {'id': str(tile_desc['id']), 
@@ -915,9 +927,7 @@ for tile_name, tile_desc in tile_types.items():
 
 grid = ET.SubElement(rr_graph, 'grid')
 
-print()
-print("Generate grid")
-print("="*75)
+lib.log.start_phase(log, "Generate grid")
 
 for x in range(ic.max_x+3):
     for y in range(ic.max_y+3):
@@ -936,10 +946,9 @@ for x in range(ic.max_x+3):
              'width_offset':  "0",
              'height_offset': "0",
             })
+        lib.log.count("grid_loc")
 
-print()
-print("Generate tiles (with pins and local tracks)")
-print("="*75)
+lib.log.start_phase(log, "Generate tiles (with pins and local tracks)")
 
 for x, y in all_tiles:
 
@@ -960,9 +969,7 @@ for x, y in all_tiles:
     }
 
     # Add pins for the tile
-    print()
-    print("{}: Adding pins".format(tid))
-    print("-"*75)
+    log.debug("%s: Adding pins", tid)
     for idx, (name, (dir, _)) in enumerate(tile_type["pin_map"].items()):
         add_pin(pos, name, dir, idx)
 
@@ -974,17 +981,13 @@ for x, y in all_tiles:
         groups_local = (LOCAL_TRACKS_MAX_GROUPS, LOCAL_TRACKS_PER_GROUP)
         groups_glb2local = GBL2LOCAL_MAX_TRACKS
 
-    print()
-    print("{}: Adding local tracks".format(tid))
-    print("-"*75)
+    log.debug("%s: Adding local tracks", tid)
     for g in range(0, groups_local[0]):
         for i in range(0, groups_local[1]):
             add_track_local(pos, g, i)
 
     if groups_glb2local:
-        print()
-        print("{}: Adding glb2local tracks".format(tid))
-        print("-"*75)
+        log.debug("%s: Adding glb2local tracks", tid)
         for i in range(0, groups_glb2local):
             add_track_gbl2local(pos, i)
 
@@ -993,7 +996,7 @@ for x, y in all_tiles:
 # ------------------------------
 
 def globalname_net(pos, name):
-    return netname2globalname[(pos, name)]
+    return globalnames[tile_netnames[pos][name]]
 
 
 def _calculate_globalname_net(group):
@@ -1070,7 +1073,7 @@ def _calculate_globalname_net(group):
             wire_type += [(pos, int(m.group(1)), pos, 1)]
             return GlobalName(*wire_type)
 
-        print("Unknown only local net {}".format(name))
+        log.debug("Unknown only local net %s", name)
         return None
 
     # Global wire, as only has one name?
@@ -1236,9 +1239,7 @@ def _calculate_globalname_net(group):
 
 # ------------------------------
 
-print()
-print("Calculating nets")
-print("="*75)
+lib.log.start_phase(log, "Calculating nets")
 
 def filter_name(localname):
     if localname.endswith('cout') or localname.endswith('lout'):
@@ -1256,7 +1257,7 @@ def filter_localnames(group):
     fgroup = []
     for x,y,name in group:
         if not ic.tile_has_entry(x, y, name):
-            print("Skipping {} on {},{}".format(name, x,y))
+            log.debug("Skipping %s on %s,%s", name, x, y)
             continue
 
         if filter_name(name):
@@ -1278,36 +1279,96 @@ add_channel(GlobalName('global', 'fabout'), 'CHANY', TilePos(0, 0), TilePos(0, 0
 
 # ------------------------------
 
-all_group_segments = ic.group_segments(all_tiles, connect_gb=False)
-for group in sorted(all_group_segments):
-    fgroup = filter_localnames(group)
-    if not fgroup:
-        continue
+def calculate_nets():
+    """Group the segments into nets and calculate the global name of each.
 
-    print()
-    gname = _calculate_globalname_net(tuple(fgroup))
+    Returns a list of (group, filtered group, global name).
+    """
+    nets = []
+    all_group_segments = ic.group_segments(all_tiles, connect_gb=False)
+    for group in sorted(all_group_segments):
+        fgroup = filter_localnames(group)
+        if not fgroup:
+            continue
+
+        gname = _calculate_globalname_net(tuple(fgroup))
+        nets.append((group, fgroup, gname))
+    return nets
+
+
+def nets_cache_key():
+    """Hash of everything the result of calculate_nets() depends on."""
+    h = hashlib.sha256()
+    h.update(device_name.encode("utf-8"))
+    with open(icebox.__file__, "rb") as f:
+        h.update(f.read())
+    for func in (calculate_nets, filter_localnames, filter_name,
+                 globalname_net, _calculate_globalname_net,
+                 add_globalname2localname, globalname_pin,
+                 add_track_local, add_track_gbl2local,
+                 localname_track_local, globalname_track_local,
+                 localname_track_glb2local, globalname_track_glb2local):
+        h.update(inspect.getsource(func).encode("utf-8"))
+    tracks = (LOCAL_TRACKS_PER_GROUP, LOCAL_TRACKS_MAX_GROUPS, GBL2LOCAL_MAX_TRACKS)
+    h.update(repr(tracks).encode("utf-8"))
+    return h.hexdigest()
+
+
+nets = None
+nets_cache_file = NETS_CACHE_FILE or "icebox-nets-{}.pickle".format(device_name)
+if NETS_CACHE:
+    nets_key = nets_cache_key()
+    if os.path.exists(nets_cache_file):
+        try:
+            with open(nets_cache_file, "rb") as f:
+                cached_key, cached_nets = pickle.load(f)
+        except Exception as e:
+            # Treat a truncated or otherwise unreadable cache as a miss.
+            log.info("Ignoring unreadable cached nets in %s: %r", nets_cache_file, e)
+        else:
+            if cached_key == nets_key:
+                log.info("Using cached nets from %s", nets_cache_file)
+                nets = cached_nets
+            else:
+                log.info("Cached nets in %s are out of date", nets_cache_file)
+
+if nets is None:
+    nets = calculate_nets()
+    if NETS_CACHE:
+        # Write to a temporary file first, so an interrupted run (or another
+        # run for the same device) never leaves a partial cache.
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(nets_cache_file)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump((nets_key, nets), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, nets_cache_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+for group, fgroup, gname in nets:
     if not gname:
-        print('Could not calculate global name for', group)
+        log.debug("Could not calculate global name for %s", group)
+        lib.log.count("unknown net")
         continue
 
     if gname[0] == "pin":
         alias_type = "pin"
-        assert gname in globalname2netnames, gname
+        assert globalname_ids.get(gname, None) in globalname2netnames, gname
     else:
         alias_type = "net"
-        if gname not in globalname2netnames:
-            print("Adding net {}".format(gname))
+        if globalname_ids.get(gname, None) not in globalname2netnames:
+            log.debug("Adding net %s", gname)
+            lib.log.count("net")
 
-    print(x, y, gname, group)
+    log.debug("%s %s %s %s", x, y, gname, group)
     for x, y, netname in fgroup:
         add_globalname2localname(gname, TilePos(x, y), netname)
 
 
 # Create the channels
 # -------------------
-print()
-print("Adding span channels")
-print("-"*75)
+lib.log.start_phase(log, "Adding span channels")
 
 x_channel_offset = LOCAL_TRACKS_MAX_GROUPS * (LOCAL_TRACKS_PER_GROUP) + GBL2LOCAL_MAX_TRACKS
 y_channel_offset = 0
@@ -1345,38 +1406,28 @@ def add_track_span(globalname):
     add_channel(globalname, nodetype, start, end, idx, segtype)
 
 
-for globalname in sorted(globalname2netnames.keys()):
+for globalname in sorted(globalnames[gid] for gid in globalname2netnames):
     if globalname[0] != "channel":
         continue
     add_track_span(globalname)
 
 
-print()
-print()
-print()
-print("Channel summary")
-print("="*75)
-for channel in sorted(channels):
-    print()
-    print(channel)
-    print("-"*75)
+if log.isEnabledFor(logging.DEBUG):
+    log.debug("Channel summary")
+    for channel in sorted(channels):
+        log.debug("%s", channel)
 
-    m = max(channels[channel])
+        m = max(channels[channel])
 
-    for idx in range(0, m+1):
-        print()
-        print(idx)
-        if idx not in channels[channel]:
-            print("-"*5)
-            continue
-        for track in channels[channel][idx]:
-            if track in globalname2netnames:
-                print(track, globalname2netnames[track])
-            else:
-                print(track, None)
-print()
-print("Generate channels")
-print("="*75)
+        for idx in range(0, m+1):
+            log.debug("%s", idx)
+            if idx not in channels[channel]:
+                log.debug("-"*5)
+                continue
+            for track in channels[channel][idx]:
+                log.debug("%s %s", track, globalname2netnames.get(globalname_ids[track], None))
+
+lib.log.start_phase(log, "Generate channels")
 # TODO check this
 chwm = LOCAL_TRACKS_MAX_GROUPS * (LOCAL_TRACKS_PER_GROUP+1) + GBL2LOCAL_MAX_TRACKS + SPAN4_MAX_TRACKS + SPAN12_MAX_TRACKS + GLOBAL_MAX_TRACKS
 
@@ -1424,18 +1475,23 @@ for i in range(4):
     </rr_edges>
 """
 
-print()
-print("Generating edges")
-print("="*75)
+def tile_edges(xy):
+    """Find the edges for the switches inside a tile.
 
-for x, y in all_tiles:
+    Only reads the global state, so can be run in a forked worker process.
+    Returns a list of (src node id, dst node id), the number of switches
+    skipped and the debug messages to print about them (only built if debug
+    logging is enabled).
+    """
+    x, y = xy
     pos = TilePos(x, y)
-    if pos in corner_tiles:
-        continue
 
-    print()
-    print(x, y)
-    print("-"*75)
+    # local name -> global name id for this tile
+    netnames = tile_netnames.get(pos, {})
+
+    edges = []
+    skipped = 0
+    messages = []
     for entry in ic.tile_db(x, y):
         if not ic.tile_has_entry(x, y, entry):
             continue
@@ -1451,28 +1507,70 @@ for x, y in all_tiles:
         if filter_name(src_localname) or filter_name(dst_localname):
             continue
 
-        src_globalname = localname2globalname(pos, src_localname, default='???')
-        dst_globalname = localname2globalname(pos, dst_localname, default='???')
+        src_gid = netnames.get(src_localname, None)
+        dst_gid = netnames.get(dst_localname, None)
 
-        src_nodeid = globalname2nodeid.get(src_globalname, None)
-        dst_nodeid = globalname2nodeid.get(dst_globalname, None)
+        src_nodeid = -1 if src_gid is None else globalname_nodeids[src_gid]
+        dst_nodeid = -1 if dst_gid is None else globalname_nodeids[dst_gid]
 
-        if src_nodeid is None or dst_nodeid is None:
-            print("Skipping {} ({}, {}) -> {} ({}, {})".format(
+        if src_nodeid == -1 or dst_nodeid == -1:
+            skipped += 1
+            if not debug_skipped:
+                continue
+            src_globalname = localname2globalname(pos, src_localname, default='???')
+            dst_globalname = localname2globalname(pos, dst_localname, default='???')
+            messages.append("Skipping {} ({}, {}) -> {} ({}, {})".format(
                 (pos, src_localname), src_globalname, src_nodeid,
                 (pos, dst_localname), dst_globalname, dst_nodeid,
                 ))
         else:
-            add_edge(src_globalname, dst_globalname, switch_type == "routing")
+            edges.append((src_nodeid, dst_nodeid))
+            if switch_type == "routing":
+                edges.append((dst_nodeid, src_nodeid))
+
+    return edges, skipped, messages
+
+
+lib.log.start_phase(log, "Generating edges")
+
+# Checked once here (before forking) rather than for every skipped switch.
+debug_skipped = log.isEnabledFor(logging.DEBUG)
+
+edge_tiles = [(x, y) for x, y in all_tiles if (x, y) not in corner_tiles]
+
+if JOBS > 1:
+    # The workers are forked so they share the (read only) name mappings and
+    # graph built above. imap returns the results in tile order so the output
+    # is the same as the single process version.
+    import multiprocessing
+    pool = multiprocessing.get_context("fork").Pool(JOBS)
+    tile_results = pool.imap(tile_edges, edge_tiles, chunksize=16)
+else:
+    pool = None
+    tile_results = map(tile_edges, edge_tiles)
+
+for (x, y), (edges, skipped, messages) in zip(edge_tiles, tile_results):
+    log.debug("%s %s", x, y)
+    for msg in messages:
+        log.debug("%s", msg)
+    lib.log.count("skipped", skipped)
+    for src_nodeid, dst_nodeid in edges:
+        graph.add_edge(src_nodeid, dst_nodeid, 0)
+    lib.log.count("edge", len(edges))
+
+if pool is not None:
+    pool.close()
+    pool.join()
 
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
 
 
-f = open('rr_graph.xml', 'w')
-f.write(ET.tostring(rr_graph, pretty_print=True).decode('utf-8'))
-f.close()
+lib.log.start_phase(log, "Writing rr_graph.xml")
+graph.write('rr_graph.xml', rr_graph, comments=VERBOSE, names=globalnames)
+lib.log.end_phase(log)
+log.info("Wrote %s nodes and %s edges to rr_graph.xml", len(graph), graph.num_edges)
 
 # -----------------------------------------------------------------------
 # -----------------------------------------------------------------------
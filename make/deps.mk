@@ -109,11 +109,48 @@ endif
 
 ifeq (2,$(V))
 $(info ==========================================================================)
-$(info Setting up .dmk generation for XML files.)
+$(info Scanning XML and Verilog files for dependencies.)
 $(info --------------------------------------------------------------------------)
 endif
 
 DEPS_XML_INPUTS  := $(call find_nontemplate_files,*.xml)
+DEPS_VERILOG_INPUTS  := $(call find_nontemplate_files,*.v)
+
+# Generate the .dmk files for all the existing inputs with a single process
+# before they are included below, so the per file rules only need to run for
+# generated files.
+#
+# $(file) and .SHELLSTATUS need GNU make 4.2 or newer.
+ifneq (4.2,$(firstword $(sort $(MAKE_VERSION) 4.2)))
+$(error GNU make 4.2 or newer is needed to scan the dependencies, this is GNU make $(MAKE_VERSION))
+endif
+
+DEPS_SCAN_TOOL := $(UTILS_DIR)/deps_scan.py
+DEPS_SCAN_LIST := $(call deps_dir,)/scan-inputs.txt
+$(shell mkdir -p $(dir $(DEPS_SCAN_LIST)))
+$(file >$(DEPS_SCAN_LIST))$(foreach F,$(filter $(FILES_EXISTING),$(DEPS_XML_INPUTS) $(DEPS_VERILOG_INPUTS)),$(file >>$(DEPS_SCAN_LIST),$(F)))
+DEPS_SCAN_OUTPUT := $(shell $(DEPS_SCAN_TOOL) @$(DEPS_SCAN_LIST) 2>&1 | tail -n 1; exit $${PIPESTATUS[0]})
+DEPS_SCAN_STATUS := $(.SHELLSTATUS)
+
+ifneq (0,$(DEPS_SCAN_STATUS))
+$(error $(DEPS_SCAN_TOOL) failed (exit status $(DEPS_SCAN_STATUS)): $(DEPS_SCAN_OUTPUT))
+endif
+
+ifeq (2,$(V))
+$(info $(DEPS_SCAN_OUTPUT))
+$(info)
+$(info Finished scanning XML and Verilog files for dependencies.)
+$(info --------------------------------------------------------------------------)
+endif
+
+#---------------------------------------------------------------------------------
+
+ifeq (2,$(V))
+$(info ==========================================================================)
+$(info Setting up .dmk generation for XML files.)
+$(info --------------------------------------------------------------------------)
+endif
+
 DEPS_XML_OUTPUTS := $(foreach F,$(DEPS_XML_INPUTS),$(call deps_makefile,$(F)))
 
 $(foreach F,$(DEPS_XML_INPUTS),$(eval $(call _deps_expand_rule,$(call deps_makefile,$(F)),$(F))))
@@ -143,7 +180,6 @@ $(info Setting up .dmk generation for Verilog files.)
 $(info --------------------------------------------------------------------------)
 endif
 
-DEPS_VERILOG_INPUTS  := $(call find_nontemplate_files,*.v)
 DEPS_VERILOG_OUTPUTS := $(foreach F,$(DEPS_VERILOG_INPUTS),$(call deps_makefile,$(F)))
 
 $(foreach F,$(DEPS_VERILOG_INPUTS),$(eval $(call _deps_expand_rule,$(call deps_makefile,$(F)),$(F))))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Generate the Makefile .dmk fragments for many Verilog and XML files at once.
+
+Does the same as running deps_verilog.py / deps_xml.py on each file, but in a
+single process. The files included by each file are cached in the .deps
+directory (keyed by the file's modification time and size), so only files
+which changed since the last run are read again.
+
+A .dmk file is only rewritten when its content changes. If the content is the
+same but the .dmk file is older than the input, it is just touched so the per
+file make rules don't run again. This is run while make is reading the
+makefiles, before the .dmk files are included, so make never sees them
+change.
+"""
+
+import argparse
+import os
+import sys
+
+from io import StringIO
+
+from lib.deps import DEPS_DIR
+from lib.deps import IncludeCache
+from lib.deps import add_dependency
+from lib.deps import deps_makefile
+from lib.deps import write_deps
+
+import deps_verilog
+import deps_xml
+
+
+MYDIR = os.path.dirname(os.path.abspath(__file__))
+
+# Changing these changes the output, see DEPS_*_TOOL_FILES in make/deps.mk
+TOOL_FILES = [
+    os.path.join(MYDIR, "deps_verilog.py"),
+    os.path.join(MYDIR, "deps_xml.py"),
+    os.path.join(MYDIR, "lib", "deps.py"),
+]
+
+SCANNERS = {
+    ".v": deps_verilog.verilog_includes,
+    ".xml": deps_xml.xml_includes,
+}
+
+parser = argparse.ArgumentParser(
+    description=__doc__,
+    fromfile_prefix_chars='@',
+    prefix_chars='-'
+)
+parser.add_argument(
+    "inputfile",
+    nargs="*",
+    help="Input Verilog or XML files (use @file to read them from a file)")
+parser.add_argument(
+    "--index",
+    default=os.path.join(DEPS_DIR, "scan-index.pickle"),
+    help="File to cache the includes of each input file in")
+
+
+def main(argv):
+    args = parser.parse_args(argv[1:])
+
+    cache = IncludeCache(args.index)
+    written = 0
+    for inputfile in args.inputfile:
+        _, ext = os.path.splitext(inputfile)
+        assert ext in SCANNERS, "Don't know how to scan {}".format(inputfile)
+
+        inputpath = os.path.abspath(inputfile)
+        data = StringIO()
+        for includefile_path in cache.includes(inputpath, SCANNERS[ext]):
+            add_dependency(data, inputpath, includefile_path)
+
+        os.makedirs(os.path.dirname(deps_makefile(inputfile)), exist_ok=True)
+        if write_deps(inputfile, data, TOOL_FILES):
+            written += 1
+    cache.save()
+
+    print("Scanned {} files, {} dependency files changed".format(
+        len(args.inputfile), written))
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -10,10 +10,15 @@ import sys
 from io import StringIO
 
 from lib.asserts import assert_eq
+import lib.deps
 from lib.deps import add_dependency
 from lib.deps import write_deps
 
 
+# The files the make rule for the .dmk files depends on, see make/deps.mk
+TOOL_FILES = [os.path.abspath(__file__), lib.deps.__file__]
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "inputfile",
@@ -21,28 +26,37 @@ parser.add_argument(
     help="Input Verilog file")
 
 
+def verilog_includes(inputpath):
+    """Return the absolute paths of the files `included by a Verilog file."""
+    inputdir = os.path.dirname(os.path.abspath(inputpath))
+
+    includes = []
+    with open(inputpath, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith("`include"):
+                continue
+            _, includefile = line.split(" ", 1)
+            assert_eq(_, "`include")
+            assert_eq(includefile[0], '"')
+            assert_eq(includefile[-1], '"')
+            includefile = includefile[1:-1]
+
+            includes.append(os.path.abspath(os.path.join(inputdir, includefile)))
+    return includes
+
+
 def main(argv):
     args = parser.parse_args(argv[1:])
+    args.inputfile.close()
 
     inputpath = os.path.abspath(args.inputfile.name)
-    inputdir = os.path.dirname(inputpath)
 
     data = StringIO()
-    for line in args.inputfile:
-        line = line.strip()
-        if not line.startswith("`include"):
-            continue
-        _, includefile = line.split(" ", 1)
-        assert_eq(_, "`include")
-        assert_eq(includefile[0], '"')
-        assert_eq(includefile[-1], '"')
-        includefile = includefile[1:-1]
-
-        includefile_path = os.path.abspath(os.path.join(inputdir, includefile))
-
+    for includefile_path in verilog_includes(inputpath):
         add_dependency(data, inputpath, includefile_path)
 
-    write_deps(args.inputfile.name, data)
+    write_deps(args.inputfile.name, data, TOOL_FILES)
 
 
 if __name__ == "__main__":
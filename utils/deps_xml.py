@@ -10,10 +10,15 @@ import sys
 
 from io import StringIO
 
+import lib.deps
 from lib.deps import add_dependency
 from lib.deps import write_deps
 
 
+# The files the make rule for the .dmk files depends on, see make/deps.mk
+TOOL_FILES = [os.path.abspath(__file__), lib.deps.__file__]
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "inputfile",
@@ -24,24 +29,33 @@ parser.add_argument(
 xi_include = re.compile('<xi:include[^>]*href="([^"]*)"', re.IGNORECASE)
 
 
+def xml_includes(inputpath):
+    """Return the absolute paths of the files xi:included by an XML file."""
+    inputdir = os.path.dirname(os.path.abspath(inputpath))
+
+    includes = []
+    with open(inputpath, "r") as f:
+        for line in f:
+            line = line.strip()
+            if 'xi:include' not in line:
+                continue
+
+            for includefile in xi_include.findall(line):
+                includes.append(os.path.abspath(os.path.join(inputdir, includefile)))
+    return includes
+
+
 def main(argv):
     args = parser.parse_args(argv[1:])
+    args.inputfile.close()
 
     inputpath = os.path.abspath(args.inputfile.name)
-    inputdir = os.path.dirname(inputpath)
 
     data = StringIO()
-    for line in args.inputfile:
-        line = line.strip()
-        if 'xi:include' not in line:
-            continue
-
-        for includefile in xi_include.findall(line):
-            includefile_path = os.path.abspath(os.path.join(inputdir, includefile))
-
-            add_dependency(data, inputpath, includefile_path)
+    for includefile_path in xml_includes(inputpath):
+        add_dependency(data, inputpath, includefile_path)
 
-    write_deps(args.inputfile.name, data)
+    write_deps(args.inputfile.name, data, TOOL_FILES)
 
 
 if __name__ == "__main__":
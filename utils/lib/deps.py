@@ -5,6 +5,8 @@ This file needs to be kept in sync with ../../make/deps.mk
 
 import os
 import os.path
+import pickle
+import tempfile
 
 MY_DIR = os.path.dirname(os.path.abspath(__file__))
 TOP_DIR = os.path.abspath(os.path.join(MY_DIR, "..", ".."))
@@ -119,11 +121,96 @@ $(call add_dependency,{from_file},{on_file})
 ))
 
 
-def write_deps(inputfile_name, data):
+def write_deps(inputfile_name, data, tool_files=()):
+    """Write the dependency makefile for a file.
+
+    The file is only rewritten if its content changes, so make doesn't see a
+    new timestamp (and reload its makefiles) for nothing. If the content is
+    the same but the file is older than the input (or one of tool_files, the
+    files the make rule also depends on) it is touched instead, so the make
+    rule for it doesn't run again. Returns True if the file was written.
+    """
     deps_filename = deps_makefile(inputfile_name)
+    content = data.getvalue()
+    if os.path.exists(deps_filename):
+        with open(deps_filename, "r") as f:
+            unchanged = f.read() == content
+        if unchanged:
+            newest = max(os.stat(f).st_mtime for f in [inputfile_name] + list(tool_files))
+            if os.stat(deps_filename).st_mtime < newest:
+                os.utime(deps_filename)
+            return False
     with open(deps_filename, "w") as f:
-        f.write(data.getvalue())
+        f.write(content)
     print("Generated dependency info", deps_filename)
+    return True
+
+
+class IncludeCache:
+    """The files included by each file, cached on disk between runs.
+
+    Each entry is keyed by the file's modification time and size, so a file
+    is only scanned again after it changes.
+
+    >>> d = tempfile.mkdtemp()
+    >>> src = os.path.join(d, "a.v")
+    >>> with open(src, "w") as f:
+    ...     _ = f.write("module a; endmodule")
+    >>> scans = []
+    >>> def scan(path):
+    ...     scans.append(path)
+    ...     return ["b.v"]
+    >>> cache = IncludeCache(os.path.join(d, "index.pickle"))
+    >>> cache.includes(src, scan)
+    ['b.v']
+    >>> cache.save()
+    >>> IncludeCache(os.path.join(d, "index.pickle")).includes(src, scan)
+    ['b.v']
+    >>> len(scans)
+    1
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.changed = False
+        self.entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename, "rb") as f:
+                    self.entries = pickle.load(f)
+            except Exception:
+                # A corrupt (or incompatible) index just means everything is
+                # scanned again.
+                self.entries = {}
+            if not isinstance(self.entries, dict):
+                self.entries = {}
+
+    def includes(self, path, scan):
+        """Return the files included by path, calling scan(path) to find them
+        if path is new or has changed."""
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        includes = scan(path)
+        self.entries[path] = (key, includes)
+        self.changed = True
+        return includes
+
+    def save(self):
+        """Write the cache back to disk, if anything changed."""
+        if not self.changed:
+            return
+        dirname = os.path.dirname(self.filename) or "."
+        os.makedirs(dirname, exist_ok=True)
+        # Write to a temporary file first so a concurrent run never reads a
+        # partial index.
+        fd, tmp_file = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(self.entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.filename)
+        self.changed = False
 
 
 if __name__ == "__main__":
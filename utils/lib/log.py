@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Logging for the long running import scripts.
+
+The importers generate millions of objects, printing (or even just
+formatting) a message for each one takes a large part of the run time. The
+messages for each object are logged at `DEBUG` level (and only formatted when
+that level is enabled), while the main output is a one line summary of each
+phase with the number of each type of object created.
+
+Optionally every message can also be written to a file as JSON lines, one
+object per message with the level, phase and message.
+
+>>> import io
+>>> out = io.StringIO()
+>>> log = setup("test", verbosity=0, stream=out)
+>>> start_phase(log, "Adding channels")
+>>> for i in range(3):
+...     log.debug("Adding channel %s", i)
+...     count("channel")
+>>> start_phase(log, "Adding edges")
+>>> count("edge", 10)
+>>> end_phase(log)
+>>> print(out.getvalue().strip()) # doctest: +ELLIPSIS
+Adding channels: 3 channel (...s)
+Adding edges: 10 edge (...s)
+
+>>> out = io.StringIO()
+>>> log = setup("test", verbosity=1, stream=out)
+>>> start_phase(log, "Adding channels")
+>>> log.debug("Adding channel %s", 0)
+>>> count("channel")
+>>> end_phase(log)
+>>> print(out.getvalue().strip()) # doctest: +ELLIPSIS
+Adding channel 0
+Adding channels: 1 channel (...s)
+
+>>> out = io.StringIO()
+>>> jout = io.StringIO()
+>>> log = setup("test", verbosity=-1, stream=out, json_stream=jout)
+>>> start_phase(log, "Tracing")
+>>> log.debug("Tracing %s", LazyPFormat({'a': 1}))
+>>> log.warning("Issue tracing %s", 'w')
+>>> end_phase(log)
+>>> print(out.getvalue().strip())
+Issue tracing w
+>>> for l in jout.getvalue().splitlines():
+...     print(sorted(json.loads(l).items())) # doctest: +ELLIPSIS
+[('level', 'DEBUG'), ('message', "Tracing {'a': 1}"), ('phase', 'Tracing'), ('time', ...)]
+[('level', 'WARNING'), ('message', 'Issue tracing w'), ('phase', 'Tracing'), ('time', ...)]
+[('counts', {}), ('level', 'INFO'), ('message', 'Tracing: nothing (...s)'), ('phase', 'Tracing'), ('time', ...)]
+"""
+
+import json
+import logging
+import pprint
+import sys
+import time
+
+from collections import Counter
+
+
+# The phase currently running, (name, counts, start time).
+_phase = None
+
+
+class LazyPFormat:
+    """Only pretty print `obj` if the message is actually output."""
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pprint.pformat(self.obj)
+
+
+class _PhaseFilter(logging.Filter):
+    def filter(self, record):
+        record.phase = _phase[0] if _phase else None
+        return True
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """Format each record as a single line JSON object."""
+
+    def format(self, record):
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'phase': getattr(record, 'phase', None),
+            'message': record.getMessage(),
+        }
+        if hasattr(record, 'counts'):
+            data['counts'] = record.counts
+        return json.dumps(data, default=str)
+
+
+def setup(name, verbosity=0, json_log=None, stream=None, json_stream=None):
+    """Set up and return the logger for a script.
+
+    verbosity
+        -1 only outputs warnings, 0 (the default) also outputs the phase
+        summaries and 1 outputs everything.
+    json_log
+        Filename to write every message to as JSON lines.
+    """
+    log = logging.getLogger(name)
+    log.propagate = False
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+        handler.close()
+
+    if verbosity < 0:
+        level = logging.WARNING
+    elif verbosity == 0:
+        level = logging.INFO
+    else:
+        level = logging.DEBUG
+
+    console = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    console.setLevel(level)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    console.addFilter(_PhaseFilter())
+    log.addHandler(console)
+
+    if json_log is not None or json_stream is not None:
+        if json_stream is not None:
+            jhandler = logging.StreamHandler(json_stream)
+        else:
+            jhandler = logging.FileHandler(json_log, mode="w")
+        jhandler.setLevel(logging.DEBUG)
+        jhandler.setFormatter(JSONLinesFormatter())
+        jhandler.addFilter(_PhaseFilter())
+        log.addHandler(jhandler)
+        level = logging.DEBUG
+
+    log.setLevel(level)
+    return log
+
+
+def count(what, n=1):
+    """Count `n` objects of type `what` in the current phase."""
+    if _phase:
+        _phase[1][what] += n
+
+
+def start_phase(log, name):
+    """Start counting the objects created in a new phase.
+
+    Finishes the current phase (if any).
+    """
+    global _phase
+    end_phase(log)
+    _phase = (name, Counter(), time.time())
+
+
+def end_phase(log):
+    """Log a summary of the objects counted in the current phase."""
+    global _phase
+    if _phase is None:
+        return
+    name, counts, start = _phase
+    summary = ", ".join("{} {}".format(v, k) for k, v in counts.items())
+    log.info(
+        "%s: %s (%.1fs)", name, summary or "nothing", time.time() - start,
+        extra={'counts': dict(counts)})
+    _phase = None
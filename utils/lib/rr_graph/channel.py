@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import enum
+import heapq
 import io
 
+from array import array
 from collections import namedtuple
 
 from . import Pos
@@ -246,6 +248,45 @@ class Channel(_Channel):
 C = Channel
 
 
+def pack_tracks(intervals):
+    """Assign tracks to the (start, end) intervals along one row / column.
+
+    Intervals which overlap (the ends are inclusive) get different tracks.
+    Processing the intervals in order of their start and reusing the lowest
+    freed track means the number of tracks used is the maximum number of
+    intervals overlapping any position, which is the minimum possible.
+
+    Returns the track of each interval, in the same order as `intervals`.
+
+    >>> pack_tracks([(0, 2), (1, 3), (3, 5), (4, 4), (0, 0)])
+    [1, 0, 1, 0, 0]
+    >>> # The ends can be given in either order
+    >>> pack_tracks([(5, 3), (0, 3)])
+    [1, 0]
+    >>> pack_tracks([])
+    []
+    """
+    order = sorted(
+        range(len(intervals)), key=lambda i: (min(intervals[i]), max(intervals[i])))
+
+    tracks = [None] * len(intervals)
+    active = []     # (end, track) of the intervals still in use
+    free = []       # tracks free to be reused
+    width = 0
+    for i in order:
+        start, end = min(intervals[i]), max(intervals[i])
+        while active and active[0][0] < start:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        if free:
+            track = heapq.heappop(free)
+        else:
+            track = width
+            width += 1
+        tracks[i] = track
+        heapq.heappush(active, (end, track))
+    return tracks
+
+
 class ChannelGrid(dict):
     def __init__(self, size, chan_type):
         self.chan_type = chan_type
@@ -255,6 +296,17 @@ class ChannelGrid(dict):
             for y in range(0, self.y):
                 self[Pos(x,y)] = []
 
+        # Every channel added, the index is the channel id used in the
+        # occupancy arrays.
+        self.channels = []
+
+        # For each row / column, the bitmask of track indexes used in each
+        # cell, the number of tracks (the length of every cell's list) and a
+        # (track x position) array of channel ids.
+        self._used = {}
+        self._width = {}
+        self._occupancy = {}
+
     @property
     def x(self):
         return self.size.x
@@ -275,6 +327,52 @@ class ChannelGrid(dict):
             row.append(self[Pos(x, y)])
         return row
 
+    def _line_len(self):
+        if self.chan_type == Channel.Type.X:
+            return self.y
+        elif self.chan_type == Channel.Type.Y:
+            return self.x
+        else:
+            assert False
+
+    def occupancy(self, common):
+        """Channel ids (index into `channels`) of a row / column.
+
+        Returns a 2-D memoryview (track x position) of the underlying array,
+        with -1 for unused positions, or None if there are no channels in the
+        row / column. The view is not a copy, so must be released before any
+        more channels are added to the row / column.
+
+        >>> g = ChannelGrid((4, 2), Channel.Type.Y)
+        >>> g.occupancy(0) is None
+        True
+        >>> g.add_channel(Channel((0, 0), (2, 0), None, "A"))
+        C(A,0)
+        >>> g.add_channel(Channel((1, 0), (3, 0), None, "B"))
+        C(B,1)
+        >>> with g.occupancy(0) as m:
+        ...     m.shape, m.tolist()
+        ((2, 4), [[0, 0, 0, -1], [-1, 1, 1, 1]])
+        >>> g.channels[1]
+        C(B,1)
+        >>> g.utilisation(0)
+        array('i', [1, 2, 2, 1])
+        >>> g.utilisation(1)
+        array('i', [0, 0, 0, 0])
+        """
+        occupancy = self._occupancy.get(common, None)
+        if occupancy is None:
+            return None
+        return memoryview(occupancy).cast('B').cast(
+            occupancy.typecode, (self._width[common], self._line_len()))
+
+    def utilisation(self, common):
+        """Number of tracks used at each position of a row / column."""
+        used = self._used.get(common, None)
+        if used is None:
+            return array('i', [0] * self._line_len())
+        return array('i', (bin(m).count('1') for m in used))
+
     def add_channel(self, ch):
         """
         >>> g = ChannelGrid((10, 10), Channel.Type.Y)
@@ -369,15 +467,16 @@ class ChannelGrid(dict):
             else:
                 ch.type = self.chan_type
 
+        common = ch.common
         if ch.type == Channel.Type.X:
-            l = self.column(ch.common)
+            line_len = self.y
+            pos = lambda i: Pos(common, i)
         elif ch.type == Channel.Type.Y:
-            l = self.row(ch.common)
+            line_len = self.x
+            pos = lambda i: Pos(i, common)
         else:
             assert False
 
-        assert_len_eq(l)
-
         s = ch.start0
         e = ch.end0
         if ch.direction == Channel.Direction.DEC:
@@ -385,32 +484,42 @@ class ChannelGrid(dict):
 
         assert e >= s
 
-        assert s < len(l), (s, '<', len(l), l)
-        assert e < len(l), (e+1, '<', len(l), l)
-
-        # Find a idx that this channel fits.
-        max_idx = 0
-        while True:
-            for p in l[s:e+1]:
-                while len(p) < max_idx+1:
-                    p.append(None)
-                if p[max_idx] != None:
-                    max_idx += 1
-                    break
-            else:
-                break
+        assert s < line_len, (s, '<', line_len)
+        assert e < line_len, (e+1, '<', line_len)
 
-        # Make sure everything has the same length.
-        for p in l:
-            while len(p) < max_idx+1:
-                p.append(None)
+        if common not in self._used:
+            self._used[common] = [0] * line_len
+            self._width[common] = 0
+            self._occupancy[common] = array('i')
+        used = self._used[common]
+        occupancy = self._occupancy[common]
 
-        assert_len_eq(l)
+        # Find the lowest idx which is free in every cell of the channel.
+        mask = 0
+        for m in used[s:e+1]:
+            mask |= m
+        idx = (~mask & (mask + 1)).bit_length() - 1
 
-        ch = ch.update_idx(max_idx)
-        assert ch.idx == max_idx
-        for p in l[s:e+1]:
-            p[ch.idx] = ch
+        # Make sure everything has the same length.
+        width = self._width[common]
+        if idx >= width:
+            padding = [None] * (idx + 1 - width)
+            for i in range(0, line_len):
+                self[pos(i)].extend(padding)
+            occupancy.extend([-1] * (line_len * (idx + 1 - width)))
+            self._width[common] = idx + 1
+
+        ch = ch.update_idx(idx)
+        assert ch.idx == idx
+        chan_id = len(self.channels)
+        self.channels.append(ch)
+
+        bit = 1 << idx
+        base = idx * line_len
+        for i in range(s, e+1):
+            used[i] |= bit
+            occupancy[base+i] = chan_id
+            self[pos(i)][idx] = ch
         return ch
 
     def pretty_print(self):
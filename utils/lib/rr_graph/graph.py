@@ -30,6 +30,11 @@ def frozendict(*args, **kwargs):
 class MostlyReadOnly:
     """Object which is **mostly** read only.
 
+    The read only view of each attribute is only created on first access and
+    then cached. Setting an attribute (via the `_` prefixed name) drops the
+    cached view, code which modifies a container attribute in place must call
+    `_invalidate` afterwards.
+
     >>> class MyRO(MostlyReadOnly):
     ...     __slots__ = ["_str", "_list", "_set", "_dict"]
     >>> a = MyRO()
@@ -58,6 +63,11 @@ class MostlyReadOnly:
     [('a', 1), ('b', 2), ('c', 3), ('d', 4)]
     >>> sorted(b.items())
     [('a', 1), ('b', 2), ('c', 3)]
+    >>> a.dict is b
+    True
+    >>> a._invalidate('dict')
+    >>> sorted(a.dict.items())
+    [('a', 1), ('b', 2), ('c', 3), ('d', 4)]
     >>> a
     MyRO(str='t', list=[1, 2, 3], set={1, 2, 3}, dict={'a': 1, 'b': 2, 'c': 3, 'd': 4})
     >>> a.missing
@@ -72,6 +82,10 @@ class MostlyReadOnly:
     Traceback (most recent call last):
         ...
     AttributeError: missing not found
+
+    >>> import copy
+    >>> copy.deepcopy(a)
+    MyRO(str='t', list=[1, 2, 3], set={1, 2, 3}, dict={'a': 1, 'b': 2, 'c': 3, 'd': 4})
     """
 
     def __setattr__(self, key, new_value=None):
@@ -81,7 +95,9 @@ class MostlyReadOnly:
                 return
             elif current_value != None:
                 raise AttributeError("{} is already set to {}, can't be changed".format(key, current_value))
-            return super().__setattr__(key, new_value)
+            super().__setattr__(key, new_value)
+            self._invalidate(key[1:])
+            return
 
         if "_"+key not in self.__class__.__slots__:
             raise AttributeError("{} not found".format(key))
@@ -94,20 +110,38 @@ class MostlyReadOnly:
 
         value = getattr(self, "_"+key, None)
         if isinstance(value, (tuple, int, bytes, str, type(None), MostlyReadOnly)):
-            return value
+            view = value
         elif isinstance(value, list):
-            return tuple(value)
+            view = tuple(value)
         elif isinstance(value, set):
-            return frozenset(value)
+            view = frozenset(value)
         elif isinstance(value, dict):
-            return frozendict(value)
+            view = frozendict(value)
         elif isinstance(value, enum.Enum):
-            return value
+            view = value
         else:
             raise AttributeError(
                 "Unable to return {}, don't now how to make type {} (from {!r}) read only.".format(
                     key, type(value), value))
 
+        # Store the view in the instance dictionary so further reads don't
+        # end up in __getattr__ at all.
+        self.__dict__[key] = view
+        return view
+
+    def _invalidate(self, key):
+        """Drop the cached read only view of attribute `key`."""
+        self.__dict__.pop(key, None)
+
+    def __getstate__(self):
+        # The cached views can't be pickled / copied (and are rebuilt on
+        # demand).
+        state = {}
+        for attr in self.__slots__:
+            if hasattr(self, attr):
+                state[attr] = getattr(self, attr)
+        return (None, state)
+
     def __repr__(self):
         attribs = []
         for attr in self.__slots__:
@@ -479,6 +513,7 @@ class PinClass(MostlyReadOnly):
 
         if pin.pin_class_index not in self._pins:
             self._pins[pin.pin_class_index] = pin
+            self._invalidate('pins')
         assert self._pins[pin.pin_class_index] is pin, "When adding {}, found {} already at index {}".format(pin, self._pins[pin.pin_class_index], pin.pin_class_index)
 
         pin._pin_class = self
@@ -632,23 +667,38 @@ class BlockType(MostlyReadOnly):
 
         if pin.block_type_index not in self._pin_index:
             self._pin_index[pin.block_type_index] = pin
+            self._invalidate('pin_index')
 
         assert_eq(self._pin_index[pin.block_type_index], pin)
 
     def _add_pin_class(self, pin_class):
         assert_type(pin_class, PinClass)
-        for p in pin_class.pins.values():
+        for p in pin_class._pins.values():
             self._could_add_pin(p)
 
         if pin_class.block_type is None:
             pin_class.block_type = self
         assert self is pin_class.block_type
 
-        for p in pin_class.pins.values():
+        for p in pin_class._pins.values():
             self._add_pin(p)
 
-        if pin_class not in self._pin_classes:
+        if not self._has_pin_class(pin_class):
             self._pin_classes.append(pin_class)
+            self._invalidate('pin_classes')
+
+    def _has_pin_class(self, pin_class):
+        # Searching the _pin_classes list makes adding pin classes quadratic,
+        # so keep a set of ids alongside it (rebuilt if it gets out of sync,
+        # for example after unpickling).
+        ids = self.__dict__.get('_pin_class_ids', None)
+        if ids is None or len(ids) != len(self._pin_classes):
+            ids = {id(pc) for pc in self._pin_classes}
+            self.__dict__['_pin_class_ids'] = ids
+        if id(pin_class) in ids:
+            return True
+        ids.add(id(pin_class))
+        return False
 
 
 class Block(MostlyReadOnly):
@@ -851,6 +901,10 @@ class RRNodeType(enum.Enum):
         return RRNodeType(xml_node.attrib["type"])
 
 
+NodeInfo = namedtuple(
+    "NodeInfo", ("type", "low", "high", "ptc", "side", "direction", "name"))
+
+
 class GraphIdsMap:
     def __init__(self, block_graph, xml_graph=None):
         assert_type(block_graph, BlockGraph)
@@ -859,6 +913,13 @@ class GraphIdsMap:
         self.name2id  = {}
         self.id2node = {'node': {}, 'edge': {}}
 
+        # Node id -> list of edges starting / ending at the node
+        self._edges_from = {}
+        self._edges_to = {}
+
+        # Node id -> NodeInfo decoded from the XML when the node was added
+        self._node_info = {}
+
         self._block_graph = block_graph
 
         if xml_graph is None:
@@ -869,6 +930,8 @@ class GraphIdsMap:
 
         for node in self._xml_nodes:
             self.add_node(node)
+        for edge in self._xml_graph.iterfind("rr_edges/edge"):
+            self.add_edge(edge)
 
     def clear_graph(self):
         """Delete the existing nodes and edges."""
@@ -877,6 +940,9 @@ class GraphIdsMap:
 
         self.name2id  = {}
         self.id2node = {'node': {}, 'edge': {}}
+        self._edges_from = {}
+        self._edges_to = {}
+        self._node_info = {}
 
     def _next_id(self, xml_group):
         return len(self.id2node[xml_group])
@@ -907,11 +973,57 @@ class GraphIdsMap:
         if 'capacity' not in xml_node.attrib:
             xml_node.attrib['capacity'] =  str(1)
 
-        name = self.node_name(xml_node)
-        self[name] = xml_node
+        info = self._decode_node(xml_node)
+        self[info.name] = xml_node
+        self._node_info[self.name2id[info.name]] = info
 
         if verbose:
-            xml_node.append(ET.Comment(" {} ".format(name)))
+            xml_node.append(ET.Comment(" {} ".format(info.name)))
+
+    def add_edge(self, xml_edge, verbose=False):
+        """Add an `edge` to the map (and the source / sink indexes).
+
+        >>> bg = simple_test_graph()
+        >>> xml_string1 = '''
+        ... <rr_graph>
+        ...  <rr_nodes>
+        ...   <node id="0" type="SOURCE" capacity="1">
+        ...     <loc xlow="0" ylow="3" xhigh="0" yhigh="3" ptc="0"/>
+        ...   </node>
+        ...   <node id="1" type="OPIN" capacity="1">
+        ...     <loc xlow="0" ylow="3" xhigh="0" yhigh="3" side="TOP" ptc="0"/>
+        ...   </node>
+        ...  </rr_nodes>
+        ...  <rr_edges>
+        ...   <edge src_node="0" sink_node="1" switch_id="0"/>
+        ...  </rr_edges>
+        ... </rr_graph>
+        ... '''
+        >>> m = GraphIdsMap(block_graph=bg, xml_graph=ET.fromstring(xml_string1))
+        >>> m.add_edge(ET.SubElement(m._xml_edges, 'edge', {
+        ...     'src_node': '0', 'sink_node': '1', 'switch_id': '0'}))
+        Traceback (most recent call last):
+            ...
+        AssertionError: Edge 'X000Y003_INBLOCK[00].SRC--> ->>- X000Y003_INBLOCK[00].T-PIN>' already exists
+        """
+        name = self.edge_name(xml_edge)
+        edge_id = self.name2id.get(name, None)
+        if edge_id is not None:
+            assert self.id2node['edge'][edge_id] is xml_edge, (
+                "Edge {!r} already exists".format(name))
+        self[name] = xml_edge
+
+        if verbose:
+            xml_edge.append(ET.Comment(" {} ".format(name)))
+
+    def _index_edge(self, xml_edge):
+        src_id = xml_edge.get('src_node', None)
+        assert src_id is not None, ET.tostring(xml_edge)
+        snk_id = xml_edge.get('sink_node', None)
+        assert snk_id is not None, ET.tostring(xml_edge)
+
+        self._edges_from.setdefault(src_id, []).append(xml_edge)
+        self._edges_to.setdefault(snk_id, []).append(xml_edge)
 
     def __getitem__(self, name):
         xml_group, node_id = self.names2id[name]
@@ -930,11 +1042,40 @@ class GraphIdsMap:
 
         if name in self.name2id:
             assert_eq(self.name2id[name], node_id)
-            assert obj is self.id2node[node_id]
+            assert xml_node is self.id2node[xml_group][node_id]
+            return
 
         self.id2node[xml_group][node_id] = xml_node
         self.name2id[name] = node_id
 
+        if xml_group == 'edge':
+            self._index_edge(xml_node)
+
+    def node_info(self, xml_node):
+        """Get the decoded `NodeInfo` for an `node` in the rr_nodes.
+
+        Nodes added to the map are only decoded once (in `add_node`), so they
+        must not be modified after being added.
+
+        >>> bg = simple_test_graph()
+        >>> m = GraphIdsMap(block_graph=bg)
+        >>> n = ET.fromstring('''
+        ... <node id="1" type="OPIN" capacity="1">
+        ...   <loc xlow="0" ylow="3" xhigh="0" yhigh="3" side="TOP" ptc="1"/>
+        ... </node>
+        ... ''')
+        >>> m.add_node(n)
+        >>> m.node_info(n) is m.node_info(n)
+        True
+        >>> m.node_info(n)
+        NodeInfo(type=<RRNodeType.output_pin: 'OPIN'>, low=P(x=0, y=3), high=P(x=0, y=3), ptc=1, side='TOP', direction=None, name='X000Y003_INBLOCK[01].T-PIN>')
+        """
+        node_id = xml_node.get('id', None)
+        info = self._node_info.get(node_id, None)
+        if info is not None and self.id2node['node'].get(node_id, None) is xml_node:
+            return info
+        return self._decode_node(xml_node)
+
     def node_name(self, xml_node):
         """Get a globally unique name for an `node` in the rr_nodes.
 
@@ -1004,29 +1145,36 @@ class GraphIdsMap:
         'X003Y000||05|>X003Y000'
         'X003Y000<|05||X003Y000'
         """
-
-        loc_node = list(xml_node.iterfind("./loc"))[0]
-        low = Position(int(loc_node.attrib["xlow"]), int(loc_node.attrib["ylow"]))
-        high = Position(int(loc_node.attrib["xhigh"]), int(loc_node.attrib["yhigh"]))
-        ptc = int(loc_node.attrib["ptc"])
-        edge = loc_node.attrib.get("side", " ")[0]
+        return self.node_info(xml_node).name
+
+    def _decode_node(self, xml_node):
+        loc_node = xml_node.find("loc")
+        assert loc_node is not None, ET.tostring(xml_node)
+        loc = loc_node.attrib
+        low = Position(int(loc["xlow"]), int(loc["ylow"]))
+        high = Position(int(loc["xhigh"]), int(loc["yhigh"]))
+        ptc = int(loc["ptc"])
+        side = loc.get("side", None)
+        edge = (side or " ")[0]
+        direction = xml_node.attrib.get("direction", None)
 
         type_str = None
         node_type = RRNodeType.from_xml(xml_node)
         if False:
             pass
         elif node_type in (RRNodeType.channel_x, RRNodeType.channel_y):
-            direction = {
+            dir_fmt = {
                 'INC_DIR': '{f}{f}{ptc:02d}{f}>',
                 'DEC_DIR': '<{f}{ptc:02d}{f}{f}',
-            }[xml_node.attrib.get("direction")]
+            }[direction]
 
             block_from = self._block_graph[low]
             block_to   = self._block_graph[high]
-            return "X{:03d}Y{:03d}{}X{:03d}Y{:03d}".format(
+            name = "X{:03d}Y{:03d}{}X{:03d}Y{:03d}".format(
                 block_from.x, block_from.y,
-                direction.format(f={RRNodeType.channel_x: '-', RRNodeType.channel_y: '|'}[node_type], ptc=ptc),
+                dir_fmt.format(f={RRNodeType.channel_x: '-', RRNodeType.channel_y: '|'}[node_type], ptc=ptc),
                 block_to.x, block_to.y)
+            return NodeInfo(node_type, low, high, ptc, side, direction, name)
         elif node_type is RRNodeType.input_class:
             type_str = "SINK-<"
             # FIXME: Check high == block.position + block.block_type.size
@@ -1045,9 +1193,10 @@ class GraphIdsMap:
 
         block = self._block_graph[low]
 
-        return "X{x:03d}Y{y:03d}_{t}[{i:02d}].{s}".format(
+        name = "X{x:03d}Y{y:03d}_{t}[{i:02d}].{s}".format(
             t=block.block_type.name, x=block.position.x, y=block.position.y,
             i=ptc, s=type_str)
+        return NodeInfo(node_type, low, high, ptc, side, direction, name)
 
     def nodes_for_edge(self, xml_node):
         assert xml_node.tag == 'edge'
@@ -1095,22 +1244,58 @@ class GraphIdsMap:
         else:
             return "{} ->>- {}".format(self.node_name(src_node), self.node_name(snk_node))
 
-    def edges_for_node(self, xml_node):
+    def _node_id(self, xml_node):
         node_id = xml_node.attrib.get('id', None)
         assert node_id is not None, ET.tostring(xml_node)
+        return node_id
 
-        edges = []
-        for edge_node in self._xml_edges:
-            src_node, snk_node = self.nodes_for_edge(edge_node)
+    def edges_from_node(self, xml_node):
+        """Get the edges which have `xml_node` as the source."""
+        return list(self._edges_from.get(self._node_id(xml_node), []))
 
-            src_id = src_node.get('id', None)
-            assert src_id is not None, ET.tostring(src_node)
-            snk_id = snk_node.get('id', None)
-            assert snk_id is not None, ET.tostring(snk_node)
+    def edges_to_node(self, xml_node):
+        """Get the edges which have `xml_node` as the sink."""
+        return list(self._edges_to.get(self._node_id(xml_node), []))
 
-            if src_id == node_id or snk_id == node_id:
-                edges.append(edge_node)
+    def edges_for_node(self, xml_node):
+        """Get the edges which start or end at `xml_node`.
 
+        >>> bg = simple_test_graph()
+        >>> xml_string1 = '''
+        ... <rr_graph>
+        ...  <rr_nodes>
+        ...   <node id="0" type="SOURCE" capacity="1">
+        ...     <loc xlow="0" ylow="3" xhigh="0" yhigh="3" ptc="0"/>
+        ...   </node>
+        ...   <node id="1" type="OPIN" capacity="1">
+        ...     <loc xlow="0" ylow="3" xhigh="0" yhigh="3" side="TOP" ptc="0"/>
+        ...   </node>
+        ...   <node capacity="1" direction="INC_DIR" id="2" type="CHANY">
+        ...     <loc ptc="5" xhigh="3" xlow="0" yhigh="0" ylow="3"/>
+        ...   </node>
+        ...  </rr_nodes>
+        ...  <rr_edges>
+        ...   <edge src_node="0" sink_node="1" switch_id="0"/>
+        ...   <edge src_node="1" sink_node="2" switch_id="0"/>
+        ...  </rr_edges>
+        ... </rr_graph>
+        ... '''
+        >>> m = GraphIdsMap(block_graph=bg, xml_graph=ET.fromstring(xml_string1))
+        >>> opin = m.id2node['node']['1']
+        >>> [m.edge_name(e) for e in m.edges_for_node(opin)]
+        ['X000Y003_INBLOCK[00].T-PIN> ->>- X000Y003||05|>X003Y000', 'X000Y003_INBLOCK[00].SRC--> ->>- X000Y003_INBLOCK[00].T-PIN>']
+        >>> m.add_edge(ET.SubElement(m._xml_edges, 'edge', {
+        ...     'src_node': '2', 'sink_node': '1', 'switch_id': '0'}))
+        >>> [m.edge_name(e, flip=True) for e in m.edges_to_node(opin)]
+        ['X000Y003_INBLOCK[00].T-PIN> -<<- X000Y003_INBLOCK[00].SRC-->', 'X000Y003_INBLOCK[00].T-PIN> -<<- X000Y003||05|>X003Y000']
+        """
+        node_id = self._node_id(xml_node)
+
+        edges = self.edges_from_node(xml_node)
+        for edge_node in self._edges_to.get(node_id, []):
+            # Don't return edges from a node to itself twice.
+            if edge_node.get('src_node') != node_id:
+                edges.append(edge_node)
         return edges
 
     def add_nodes_for_pin(self, block, pin):
@@ -1358,16 +1543,8 @@ def print_objects(rr_graph):
     for node in ids._xml_nodes:
         print()
         print(ids.node_name(node))
-        srcs = []
-        snks = []
-        for e in ids.edges_for_node(node):
-            src, snk = ids.nodes_for_edge(e)
-            if src == node:
-                srcs.append(e)
-            elif snk == node:
-                snks.append(e)
-            else:
-                print("!?@", ids.edge_name(e))
+        srcs = ids.edges_from_node(node)
+        snks = ids.edges_to_node(node)
 
         print("  Sources:")
         for e in srcs:
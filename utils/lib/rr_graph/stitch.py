@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Generating an rr_graph in separate regions and stitching them together.
+
+Each region of the device produces a `PartialGraph` holding the nodes it owns
+and the edges between them. Edges which cross into another region can't be
+given a node id yet, so they are kept as "stubs" referring to the nodes by
+name. `stitch` appends the nodes and edges of each partial graph (offsetting
+the node ids) and then resolves the stubs against the combined graph.
+
+>>> left = PartialGraph(((0, 0), (1, 3)))
+>>> left.graph.add_node("L/OUT", "OPIN", (1, 1), (1, 1), 0)
+0
+>>> left.graph.add_node("L/WIRE", "CHANX", (1, 1), (2, 1), 0, direction="INC_DIR", segment=1)
+1
+>>> left.add_edge("L/OUT", "L/WIRE")
+>>> left.add_edge("L/WIRE", "R/IN")
+>>> left.stubs
+[('L/WIRE', 'R/IN', 0)]
+
+>>> right = PartialGraph(((2, 0), (3, 3)))
+>>> right.graph.add_node("R/IN", "IPIN", (2, 1), (2, 1), 0)
+0
+
+>>> g = stitch([left, right])
+>>> [g.node(i)[0] for i in range(len(g))]
+['L/OUT', 'L/WIRE', 'R/IN']
+>>> list(g.edges())
+[(0, 1, 0), (1, 2, 0)]
+
+>>> stitch([left])
+Traceback (most recent call last):
+    ...
+KeyError: "Edge 'L/WIRE' -> 'R/IN' from region ((0, 0), (1, 3)) has no node 'R/IN'"
+"""
+
+import os
+import pickle
+import tempfile
+
+from .store import GraphStore
+
+
+class PartialGraph:
+    """The part of an rr_graph owned by one rectangular region.
+
+    region
+        ((x_low, y_low), (x_high, y_high)) of the region.
+    key
+        Identifies the inputs the partial graph was generated from, so it
+        only needs regenerating when they change.
+    graph
+        `GraphStore` with the nodes owned by the region and the edges
+        between them.
+    stubs
+        (src name, sink name, switch id) of the edges to or from nodes in
+        other regions.
+    """
+
+    def __init__(self, region, key=None):
+        self.region = region
+        self.key = key
+        self.graph = GraphStore()
+        self.stubs = []
+
+    def add_edge(self, src_name, sink_name, switch_id=0):
+        """Add an edge, as a stub if either node is not in this region."""
+        src_id = self.graph.node_id(src_name, None)
+        sink_id = self.graph.node_id(sink_name, None)
+        if src_id is None or sink_id is None:
+            self.stubs.append((src_name, sink_name, switch_id))
+        else:
+            self.graph.add_edge(src_id, sink_id, switch_id)
+
+    def save(self, filename):
+        # Write to a temporary file first, so an interrupted run never leaves
+        # a truncated partial graph behind.
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, filename)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            partial = pickle.load(f)
+        assert isinstance(partial, cls), (filename, partial)
+        return partial
+
+
+def stitch(partials, graph=None):
+    """Combine the partial graphs into one `GraphStore`.
+
+    Node names must be unique across all the partial graphs and every stub
+    must refer to a node in one of them.
+    """
+    if graph is None:
+        graph = GraphStore()
+
+    for partial in partials:
+        graph.extend(partial.graph)
+
+    for partial in partials:
+        for src_name, sink_name, switch_id in partial.stubs:
+            ids = []
+            for name in (src_name, sink_name):
+                node_id = graph.node_id(name, None)
+                if node_id is None:
+                    raise KeyError(
+                        "Edge {!r} -> {!r} from region {} has no node {!r}".format(
+                            src_name, sink_name, partial.region, name))
+                ids.append(node_id)
+            graph.add_edge(ids[0], ids[1], switch_id)
+
+    return graph
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Compact storage for the nodes and edges of an rr_graph.
+
+The importers generate millions of nodes and edges, keeping each one as an
+lxml element (plus a dictionary from the global name to the element and
+another to the id as a string) uses a lot of memory. `GraphStore` instead keeps
+each node attribute in a parallel `array` column indexed by the node id, and
+each edge as three integers. The XML is only generated when the graph is
+written out.
+"""
+
+import math
+
+from array import array
+
+import lxml.etree as ET
+
+from . import Position
+from .graph import RRNodeType
+from .stream import GraphStreamWriter
+from ..asserts import assert_eq
+
+
+NODE_TYPES = tuple(t.value for t in RRNodeType)
+NODE_DIRECTIONS = (None, 'INC_DIR', 'DEC_DIR', 'BI_DIR')
+NODE_SIDES = (None, 'LEFT', 'RIGHT', 'TOP', 'BOTTOM')
+
+
+def _index(values):
+    return {v: i for i, v in enumerate(values)}
+
+
+def _float_str(v):
+    """
+    >>> _float_str(0.0)
+    '0'
+    >>> _float_str(101)
+    '101'
+    >>> _float_str(2.72700004e-14)
+    '2.72700004e-14'
+    """
+    s = repr(float(v))
+    if s.endswith('.0'):
+        s = s[:-2]
+    return s
+
+
+class GraphStore:
+    """Integer indexed storage of rr_graph nodes and edges.
+
+    >>> g = GraphStore()
+    >>> g.add_node("a", "SOURCE", (1, 2), (1, 2), 0, timing=(0, 0))
+    0
+    >>> g.add_node("b", "CHANX", (1, 2), (4, 2), 3, direction="INC_DIR", segment=1)
+    1
+    >>> g.add_node("a", "SINK", (1, 2), (1, 2), 0)
+    Traceback (most recent call last):
+        ...
+    KeyError: "Node 'a' already exists with id 0"
+    >>> g.node_id("b")
+    1
+    >>> g.add_edge(g.node_id("a"), g.node_id("b"))
+    >>> len(g), g.num_edges
+    (2, 1)
+    >>> g.node(1)
+    ('b', 'CHANX', P(x=1, y=2), P(x=4, y=2), 3, 'INC_DIR', None, 1)
+    >>> list(g.edges())
+    [(0, 1, 0)]
+
+    >>> import io
+    >>> f = io.BytesIO()
+    >>> g.write(f, ET.Element("rr_graph"), comments=True)
+    >>> print(f.getvalue().decode("utf-8").strip())
+    <rr_graph>
+    <rr_nodes>
+    <node id="0" type="SOURCE" capacity="1">
+      <loc xlow="1" ylow="2" xhigh="1" yhigh="2" ptc="0"/>
+      <timing R="0" C="0"/>
+      <!-- a -->
+    </node>
+    <node id="1" type="CHANX" direction="INC_DIR" capacity="1">
+      <loc xlow="1" ylow="2" xhigh="4" yhigh="2" ptc="3"/>
+      <segment segment_id="1"/>
+      <!-- b -->
+    </node>
+    </rr_nodes>
+    <rr_edges>
+    <edge src_node="0" sink_node="1" switch_id="0">
+      <!-- a -> b -->
+    </edge>
+    </rr_edges>
+    </rr_graph>
+    """
+
+    _NODE_COLUMNS = (
+        'node_type', 'node_direction', 'node_side', 'node_capacity',
+        'xlow', 'ylow', 'xhigh', 'yhigh', 'ptc', 'segment',
+        'timing_r', 'timing_c',
+    )
+
+    _type_index = _index(NODE_TYPES)
+    _direction_index = _index(NODE_DIRECTIONS)
+    _side_index = _index(NODE_SIDES)
+
+    def __init__(self):
+        # Interned node names
+        self.name2id = {}
+        self.id2name = []
+
+        # Node columns
+        self.node_type = array('B')
+        self.node_direction = array('B')
+        self.node_side = array('B')
+        self.node_capacity = array('i')
+        self.xlow = array('i')
+        self.ylow = array('i')
+        self.xhigh = array('i')
+        self.yhigh = array('i')
+        self.ptc = array('i')
+        self.segment = array('i')
+        self.timing_r = array('d')
+        self.timing_c = array('d')
+
+        # Edge columns
+        self.edge_src = array('i')
+        self.edge_sink = array('i')
+        self.edge_switch = array('i')
+
+    def __len__(self):
+        return len(self.id2name)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_src)
+
+    def node_id(self, name, default=KeyError):
+        """Get the integer id of the node called name."""
+        if default is KeyError:
+            return self.name2id[name]
+        return self.name2id.get(name, default)
+
+    def add_node(self, name, node_type, low, high, ptc,
+                 direction=None, side=None, segment=None, timing=None,
+                 capacity=1):
+        """Add a node and return its integer id.
+
+        node_type, direction and side are the strings used in the XML.
+        segment is the segment id (or None) and timing a (R, C) tuple (or
+        None).
+        """
+        if name in self.name2id:
+            raise KeyError("Node {!r} already exists with id {}".format(
+                name, self.name2id[name]))
+
+        node_id = len(self.id2name)
+        self.name2id[name] = node_id
+        self.id2name.append(name)
+
+        self.node_type.append(self._type_index[node_type])
+        self.node_direction.append(self._direction_index[direction])
+        self.node_side.append(self._side_index[side])
+        self.node_capacity.append(capacity)
+        self.xlow.append(low[0])
+        self.ylow.append(low[1])
+        self.xhigh.append(high[0])
+        self.yhigh.append(high[1])
+        self.ptc.append(ptc)
+        self.segment.append(-1 if segment is None else segment)
+        if timing is None:
+            timing = (math.nan, math.nan)
+        self.timing_r.append(timing[0])
+        self.timing_c.append(timing[1])
+        return node_id
+
+    def add_edge(self, src_id, sink_id, switch_id=0):
+        """Add an edge between two node ids."""
+        self.edge_src.append(src_id)
+        self.edge_sink.append(sink_id)
+        self.edge_switch.append(switch_id)
+
+    def extend(self, other):
+        """Append all the nodes and edges from another GraphStore.
+
+        The node ids of other are offset by the number of nodes already in
+        this store, the offset is returned.
+
+        >>> a = GraphStore()
+        >>> a.add_node("a0", "SOURCE", (0, 0), (0, 0), 0)
+        0
+        >>> b = GraphStore()
+        >>> b.add_node("b0", "SOURCE", (1, 0), (1, 0), 0)
+        0
+        >>> b.add_node("b1", "SINK", (1, 0), (1, 0), 0)
+        1
+        >>> b.add_edge(0, 1)
+        >>> a.extend(b)
+        1
+        >>> a.node_id("b1"), list(a.edges())
+        (2, [(1, 2, 0)])
+        >>> a.extend(b)
+        Traceback (most recent call last):
+            ...
+        KeyError: "Node 'b0' already exists with id 1"
+        """
+        for name in other.id2name:
+            if name in self.name2id:
+                raise KeyError("Node {!r} already exists with id {}".format(
+                    name, self.name2id[name]))
+
+        offset = len(self.id2name)
+        self.name2id.update(
+            (name, offset + i) for i, name in enumerate(other.id2name))
+        self.id2name.extend(other.id2name)
+        for column in self._NODE_COLUMNS:
+            getattr(self, column).extend(getattr(other, column))
+
+        self.edge_src.extend(i + offset for i in other.edge_src)
+        self.edge_sink.extend(i + offset for i in other.edge_sink)
+        self.edge_switch.extend(other.edge_switch)
+        return offset
+
+    def node(self, node_id):
+        """Return the details of a node as a tuple.
+
+        (name, type, low, high, ptc, direction, side, segment)
+        """
+        segment = self.segment[node_id]
+        return (
+            self.id2name[node_id],
+            NODE_TYPES[self.node_type[node_id]],
+            Position(self.xlow[node_id], self.ylow[node_id]),
+            Position(self.xhigh[node_id], self.yhigh[node_id]),
+            self.ptc[node_id],
+            NODE_DIRECTIONS[self.node_direction[node_id]],
+            NODE_SIDES[self.node_side[node_id]],
+            None if segment == -1 else segment,
+        )
+
+    def edges(self):
+        """Iterate over the edges as (src_id, sink_id, switch_id) tuples."""
+        return zip(self.edge_src, self.edge_sink, self.edge_switch)
+
+    def _comment_name(self, node_id, names):
+        name = self.id2name[node_id]
+        if names is not None:
+            name = names[name]
+        return name
+
+    def _node_xml(self, writer, node_id, comments, names=None):
+        attribs = {
+            'id': str(node_id),
+            'type': NODE_TYPES[self.node_type[node_id]],
+        }
+        direction = NODE_DIRECTIONS[self.node_direction[node_id]]
+        if direction is not None:
+            attribs['direction'] = direction
+        attribs['capacity'] = str(self.node_capacity[node_id])
+        node = writer.add_node(attribs)
+
+        loc = {
+            'xlow': str(self.xlow[node_id]), 'ylow': str(self.ylow[node_id]),
+            'xhigh': str(self.xhigh[node_id]), 'yhigh': str(self.yhigh[node_id]),
+        }
+        side = NODE_SIDES[self.node_side[node_id]]
+        if side is not None:
+            loc['side'] = side
+        loc['ptc'] = str(self.ptc[node_id])
+        ET.SubElement(node, 'loc', loc)
+
+        r = self.timing_r[node_id]
+        c = self.timing_c[node_id]
+        if not (math.isnan(r) and math.isnan(c)):
+            ET.SubElement(node, 'timing', {'R': _float_str(r), 'C': _float_str(c)})
+
+        segment = self.segment[node_id]
+        if segment != -1:
+            ET.SubElement(node, 'segment', {'segment_id': str(segment)})
+
+        if comments:
+            node.append(ET.Comment(" {} ".format(self._comment_name(node_id, names))))
+
+    def write(self, f, root, comments=False, names=None):
+        """Write the graph as XML.
+
+        root is the `rr_graph` element containing the other sections
+        (switches, segments, block_types, grid, channels). Any `rr_nodes` /
+        `rr_edges` sections in it must be empty, they mark where the nodes and
+        edges are written (see `GraphStreamWriter`).
+
+        If comments is set each node and edge gets a comment with the node
+        names, looked up in names (indexed by the node name, for when the
+        nodes are named by an interned id) if given.
+        """
+        for section in ("rr_nodes", "rr_edges"):
+            elem = root.find(section)
+            assert elem is None or len(elem) == 0, section
+
+        with GraphStreamWriter(f, root) as writer:
+            for node_id in range(len(self)):
+                self._node_xml(writer, node_id, comments, names)
+            writer.end_nodes()
+
+            for src_id, sink_id, switch_id in self.edges():
+                e = writer.add_edge({
+                    'src_node': str(src_id),
+                    'sink_node': str(sink_id),
+                    'switch_id': str(switch_id),
+                })
+                if comments:
+                    e.append(ET.Comment(" {} -> {} ".format(
+                        self._comment_name(src_id, names), self._comment_name(sink_id, names))))
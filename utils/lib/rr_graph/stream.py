@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Incremental reading and writing of rr_graph XML files.
+
+Building every `<node>` and `<edge>` as part of one big lxml tree and then
+converting the whole tree into a string means the graph ends up in memory
+twice. The `GraphStreamWriter` instead writes each node / edge to the output
+file as soon as the next one is started, so only the small sections
+(switches, segments, block_types, grid, channels) are ever held in memory.
+
+Similarly `read_sections` reads an existing rr_graph without keeping the
+(possibly millions of) nodes and edges it contains.
+"""
+
+import contextlib
+import os
+
+import lxml.etree as ET
+
+from ..asserts import assert_eq
+
+
+# The element type of each of the big sections.
+SECTION_ELEMENTS = {"rr_nodes": "node", "rr_edges": "edge"}
+
+
+def read_sections(f, skip=("rr_nodes", "rr_edges")):
+    """Read an rr_graph, dropping the `skip` sections as they are parsed.
+
+    Each node / edge in a skipped section is discarded as soon as it has
+    been parsed, so the memory used doesn't depend on the size of the graph.
+    Returns an `ElementTree` with the remaining sections.
+
+    >>> import io
+    >>> f = io.BytesIO(b'''<rr_graph tool_name="test">
+    ... <switches><switch id="0"/></switches>
+    ... <rr_nodes><node id="0"><loc ptc="0"/></node><node id="1"/></rr_nodes>
+    ... <rr_edges><edge src_node="0" sink_node="1"/></rr_edges>
+    ... <grid/>
+    ... </rr_graph>''')
+    >>> g = read_sections(f)
+    >>> [e.tag for e in g.getroot()]
+    ['switches', 'grid']
+    >>> g.find("switches/switch").attrib["id"]
+    '0'
+    """
+    tags = tuple(SECTION_ELEMENTS[section] for section in skip)
+    context = ET.iterparse(f, events=("end",), tag=tags)
+    for _, elem in context:
+        parent = elem.getparent()
+        if parent.tag in skip:
+            elem.clear()
+            parent.remove(elem)
+
+    root = context.root
+    for section in skip:
+        for elem in root.findall(section):
+            root.remove(elem)
+    return ET.ElementTree(root)
+
+
+class GraphStreamWriter:
+    """Write an rr_graph to a file as the nodes and edges are generated.
+
+    `root` is the `rr_graph` element, any sections appended to it (other than
+    `rr_nodes` and `rr_edges`) are written out when the first node is added
+    and when the writer is closed. Empty `rr_nodes` / `rr_edges` elements in
+    `root` mark where those sections go, only the sections before them are
+    written when they are started.
+
+    `add_node` and `add_edge` return the element so the caller can still add
+    children to it; the element is written when the next one is added (or the
+    writer is closed) and must not be modified after that.
+
+    `f` is a file object or a filename. If an exception is raised inside a
+    `with` block the document is not finished, and a file the writer opened
+    itself is removed, so a failed run never leaves a well formed but
+    incomplete rr_graph behind.
+
+    >>> import io
+    >>> f = io.BytesIO()
+    >>> root = ET.Element("rr_graph", {"tool_name": "test"})
+    >>> _ = ET.SubElement(root, "switches")
+    >>> w = GraphStreamWriter(f, root)
+    >>> n = w.add_node({"id": "0", "type": "SOURCE"})
+    >>> _ = ET.SubElement(n, "loc", {"ptc": "0"})
+    >>> # Edges added while the nodes are still being written are buffered.
+    >>> _ = w.add_edge({"src_node": "0", "sink_node": "1", "switch_id": "0"})
+    >>> n = w.add_node({"id": "1", "type": "SINK"})
+    >>> w.end_nodes()
+    >>> _ = w.add_edge({"src_node": "1", "sink_node": "0", "switch_id": "0"})
+    >>> _ = ET.SubElement(root, "channels")
+    >>> w.close()
+    >>> w.nodes_written, w.edges_written
+    (2, 2)
+    >>> print(f.getvalue().decode("utf-8").strip())
+    <rr_graph tool_name="test">
+    <switches/>
+    <rr_nodes>
+    <node id="0" type="SOURCE">
+      <loc ptc="0"/>
+    </node>
+    <node id="1" type="SINK"/>
+    </rr_nodes>
+    <rr_edges>
+    <edge src_node="0" sink_node="1" switch_id="0"/>
+    <edge src_node="1" sink_node="0" switch_id="0"/>
+    </rr_edges>
+    <channels/>
+    </rr_graph>
+
+    >>> f = io.BytesIO()
+    >>> root = ET.Element("rr_graph")
+    >>> for tag in ("switches", "rr_nodes", "rr_edges", "grid"):
+    ...     _ = ET.SubElement(root, tag)
+    >>> with GraphStreamWriter(f, root) as w:
+    ...     _ = w.add_node({"id": "0", "type": "SOURCE"})
+    >>> print(f.getvalue().decode("utf-8").strip())
+    <rr_graph>
+    <switches/>
+    <rr_nodes>
+    <node id="0" type="SOURCE"/>
+    </rr_nodes>
+    <rr_edges>
+    </rr_edges>
+    <grid/>
+    </rr_graph>
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "rr_graph.xml")
+    >>> with GraphStreamWriter(path, ET.Element("rr_graph")) as w:
+    ...     _ = w.add_node({"id": "0", "type": "SOURCE"})
+    ...     raise ValueError("failed")
+    Traceback (most recent call last):
+        ...
+    ValueError: failed
+    >>> os.path.exists(path)
+    False
+    """
+
+    def __init__(self, f, root):
+        self._root = root
+        self._root_written = 0
+
+        self._filename = None
+        self._file_stack = contextlib.ExitStack()
+        if isinstance(f, str):
+            self._filename = f
+            f = self._file_stack.enter_context(open(f, "wb"))
+
+        self._stack = contextlib.ExitStack()
+        self._xf = self._stack.enter_context(ET.xmlfile(f, encoding="utf-8"))
+        self._stack.enter_context(self._xf.element(root.tag, root.attrib))
+        self._xf.write("\n")
+
+        self._section = None
+        self._section_stack = None
+        self._pending = None
+        self._buffered_edges = []
+        self._nodes_done = False
+
+        self.nodes_written = 0
+        self.edges_written = 0
+
+    def _write_root_sections(self, until=None):
+        """Write any sections added to the root since the last call.
+
+        If there is an `until` placeholder element, stop after it.
+        """
+        children = list(self._root)
+        end = len(children)
+        for i in range(self._root_written, end):
+            if children[i].tag == until:
+                end = i + 1
+                break
+
+        for child in children[self._root_written:end]:
+            if child.tag in SECTION_ELEMENTS:
+                assert_eq(len(child), 0)
+                continue
+            self._xf.write(child, pretty_print=True)
+        self._root_written = end
+
+    def _flush_pending(self):
+        if self._pending is None:
+            return
+        self._xf.write(self._pending, pretty_print=True)
+        if self._section == "rr_nodes":
+            self.nodes_written += 1
+        else:
+            self.edges_written += 1
+        self._pending = None
+
+    def _open_section(self, tag):
+        self._flush_pending()
+        self._close_section()
+        self._write_root_sections(until=tag)
+
+        self._section_stack = contextlib.ExitStack()
+        self._section_stack.enter_context(self._xf.element(tag))
+        self._xf.write("\n")
+        self._section = tag
+
+    def _close_section(self):
+        if self._section is None:
+            return
+        self._flush_pending()
+        self._section_stack.close()
+        self._xf.write("\n")
+        self._section = None
+        self._section_stack = None
+
+    def add_node(self, attribs):
+        """Start a new `<node>` element, writing out the previous one."""
+        assert not self._nodes_done, "Can't add nodes after end_nodes()"
+        if self._section is None:
+            self._open_section("rr_nodes")
+        assert_eq(self._section, "rr_nodes")
+
+        self._flush_pending()
+        self._pending = ET.Element("node", attribs)
+        return self._pending
+
+    def add_edge(self, attribs):
+        """Start a new `<edge>` element.
+
+        Edges added before `end_nodes()` is called are buffered in memory until
+        the `rr_nodes` section has been finished.
+        """
+        edge = ET.Element("edge", attribs)
+        if not self._nodes_done:
+            self._buffered_edges.append(edge)
+            return edge
+
+        assert_eq(self._section, "rr_edges")
+        self._flush_pending()
+        self._pending = edge
+        return edge
+
+    def end_nodes(self):
+        """Finish the `rr_nodes` section and start the `rr_edges` one."""
+        if self._nodes_done:
+            return
+        if self._section is None:
+            self._open_section("rr_nodes")
+        self._nodes_done = True
+        self._open_section("rr_edges")
+
+        for edge in self._buffered_edges:
+            self._xf.write(edge, pretty_print=True)
+            self.edges_written += 1
+        self._buffered_edges = []
+
+    def close(self):
+        """Finish writing the graph (including any remaining sections)."""
+        self.end_nodes()
+        self._close_section()
+        self._write_root_sections()
+        self._stack.close()
+        self._file_stack.close()
+
+    def abort(self):
+        """Stop writing without finishing the document (after an error).
+
+        The output file is removed if the writer opened it, otherwise it is
+        left incomplete.
+        """
+        # Drop the open elements without writing their end tags.
+        self._stack.pop_all()
+        self._file_stack.close()
+        if self._filename is not None:
+            os.remove(self._filename)
+            self._filename = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
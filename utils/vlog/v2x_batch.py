@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Convert the Verilog simulation models in a tree to VPR `pb_type.xml` and
+`model.xml` files in parallel.
+
+Running vlog_to_pbtype.py and vlog_to_model.py once per `.sim.v` file pays
+the Python and Yosys start up cost for every file. This converts the same
+files as the v2x make rules (the `.sim.v` files in directories with a
+`Makefile.v2x`, using its TOP_MODULE) with a pool of worker processes,
+writing `%.pb_type.xml` and `%.model.xml` next to each input.
+
+Files are converted after the files they `include, so the XML files they
+refer to are always generated first. Template files (`ntemplate.*`) are
+skipped.
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import traceback
+
+import vlog_to_model
+import vlog_to_pbtype
+
+parser = argparse.ArgumentParser(description=__doc__.strip(), formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument(
+    'inputs',
+    metavar='input', type=str, nargs='+',
+    help="""\
+`.sim.v` files, or directories to search for them. Only files in
+directories with a `Makefile.v2x` are converted.
+""")
+parser.add_argument(
+    '-j', '--jobs', type=int, default=os.cpu_count(),
+    help="""\
+Number of conversions to run at once, default the number of CPUs
+""")
+
+inc_re = re.compile(r'^\s*`include\s+"([^"]+)"')
+top_re = re.compile(r'^\s*TOP_MODULE\s*:?=\s*(\S+)')
+
+
+def v2x_top(dirname):
+    """Return the TOP_MODULE set by the Makefile.v2x in a directory, or None
+    if it doesn't set one."""
+    top = None
+    with open(os.path.join(dirname, "Makefile.v2x"), 'r') as f:
+        for line in f:
+            tm = top_re.match(line)
+            if tm:
+                top = tm.group(1)
+    return top
+
+
+def find_sim_files(inputs):
+    """Return a dict of the absolute paths of the `.sim.v` files in inputs
+    which have a v2x make rule -> the top module to pass with --top (or
+    None).
+
+    Like make/types/v2x.mk, only the `.sim.v` files directly inside a
+    directory with a `Makefile.v2x` are converted, other `.sim.v` files
+    (such as the ones with hand written XML) are left alone.
+    """
+    files = {}
+    for path in inputs:
+        if not os.path.isdir(path):
+            path = os.path.abspath(path)
+            dirname = os.path.dirname(path)
+            if not os.path.exists(os.path.join(dirname, "Makefile.v2x")):
+                raise ValueError("{} has no Makefile.v2x, not converting {}".format(dirname, path))
+            files[path] = v2x_top(dirname)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            if "Makefile.v2x" not in filenames:
+                continue
+            top = v2x_top(dirpath)
+            for fname in filenames:
+                if fname.endswith(".sim.v") and not fname.startswith("ntemplate."):
+                    files[os.path.abspath(os.path.join(dirpath, fname))] = top
+    return files
+
+
+def include_deps(path):
+    """Return the absolute paths of the files `included by path."""
+    deps = set()
+    with open(path, 'r') as f:
+        for line in f:
+            im = inc_re.match(line)
+            if im:
+                deps.add(os.path.normpath(os.path.join(os.path.dirname(path), im.group(1))))
+    return deps
+
+
+def dependency_levels(files):
+    """Group the files so every file is in a later group than the files it
+    includes. The files in each group can be converted in parallel."""
+    deps = {f: include_deps(f) & set(files) for f in files}
+    levels = []
+    done = set()
+    remaining = set(files)
+    while remaining:
+        ready = sorted(f for f in remaining if deps[f] <= done)
+        if not ready:
+            raise ValueError("`include loop between {}".format(" ".join(sorted(remaining))))
+        levels.append(ready)
+        done.update(ready)
+        remaining.difference_update(ready)
+    return levels
+
+
+def convert(job):
+    """Run a single conversion (in a worker process).
+
+    job is (tool, path of the `.sim.v` file, top module or None), where tool
+    is "pb_type" or "model". Returns the job and an error message (or None).
+    """
+    tool, simv, top = job
+    base = simv[:-len(".sim.v")]
+    top_args = ["--top", top] if top is not None else []
+    try:
+        if tool == "pb_type":
+            ret = vlog_to_pbtype.main(top_args + ["-o", base + ".pb_type.xml", simv])
+        elif tool == "model":
+            ret = vlog_to_model.main(top_args + ["-o", base + ".model.xml", simv])
+        else:
+            assert False, tool
+    except (Exception, SystemExit):
+        return job, traceback.format_exc()
+    if ret:
+        return job, "exited with {}".format(ret)
+    return job, None
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    try:
+        files = find_sim_files(args.inputs)
+    except ValueError as e:
+        parser.error(str(e))
+    levels = dependency_levels(sorted(files))
+
+    if args.jobs > 1:
+        pool = multiprocessing.get_context("fork").Pool(args.jobs)
+    else:
+        pool = None
+
+    failed = []
+    for level in levels:
+        jobs = [(tool, simv, files[simv]) for simv in level for tool in ("pb_type", "model")]
+        if pool is not None:
+            results = pool.imap_unordered(convert, jobs)
+        else:
+            results = map(convert, jobs)
+        for (tool, simv, top), error in results:
+            if error is not None:
+                print("ERROR: generating {} from {}\n{}".format(tool, simv, error))
+                failed.append((tool, simv))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    print("Converted {} files in {} steps, {} conversions failed".format(
+        len(files), len(levels), len(failed)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -75,30 +75,6 @@ parser.add_argument(
 Output filename, default 'model.xml'
 """)
 
-args = parser.parse_args()
-iname = os.path.basename(args.infiles[0])
-
-outfile = "pb_type.xml"
-if "o" in args and args.o is not None:
-    outfile = args.o
-
-yosys.run.add_define("PB_TYPE")
-vjson = yosys.run.vlog_to_json(args.infiles, flatten=False, aig=False)
-yj = YosysJSON(vjson)
-
-
-if args.top is not None:
-    top = args.top
-else:
-    wm = re.match(r"([A-Za-z0-9_]+)\.sim\.v", iname)
-    if wm:
-        top = wm.group(1).upper()
-    else:
-        print("ERROR file name not of format %.sim.v ({}), cannot detect top level. Manually specify the top level module using --top".format(iname))
-        sys.exit(1)
-
-
-tmod = yj.module(top)
 
 def mod_pb_name(mod):
     """Convert a Verilog module to a pb_type name in the format documented here:
@@ -122,9 +98,11 @@ def mod_pb_name(mod):
         #TODO: other types
         return "BLK_IG-" + mod.name
 
-def make_pb_content(mod, xml_parent, mod_pname, is_submode = False):
+def make_pb_content(yj, mod, xml_parent, mod_pname, outfile, is_submode = False):
     """Build the pb_type content - child pb_types, timing and direct interconnect,
-    but not IO. This may be put directly inside <pb_type>, or inside <mode>."""
+    but not IO. This may be put directly inside <pb_type>, or inside <mode>.
+    yj is the YosysJSON mod is from and outfile the path of the pb_type.xml
+    being generated (for the relative paths of includes)."""
 
     def get_full_pin_name(pin):
         cname, cellpin = pin
@@ -244,9 +222,9 @@ def make_pb_content(mod, xml_parent, mod_pname, is_submode = False):
                 })
                 xml_mat.text = mat
 
-def make_pb_type(mod):
+def make_pb_type(infiles, yj, mod, outfile):
     """Build the pb_type for a given module. mod is the YosysModule object to
-    generate."""
+    generate, from the YosysJSON yj of the Verilog infiles."""
 
     attrs = mod.module_attrs
     modes = mod.attr("MODES", None)
@@ -284,7 +262,7 @@ def make_pb_type(mod):
     pb_type_xml = ET.Element("pb_type", pb_xml_attrs, nsmap = {'xi': xmlinc.xi_url})
 
     # Process IOs
-    clocks = yosys.run.list_clocks(args.infiles, mod.name)
+    clocks = yosys.run.list_clocks(infiles, mod.name)
     for name, width, iodir in mod.ports:
         ioattrs = {"name": name, "num_pins": str(width), "equivalent": "false"}
         pclass = mod.net_attr(name, "PORT_CLASS")
@@ -300,22 +278,54 @@ def make_pb_type(mod):
             assert False, "bidirectional ports not supported in VPR pb_types"
 
     if has_modes:
-        for mode in modes:
-            smode = mode.strip()
+        smodes = [mode.strip() for mode in modes]
+        # Run Yosys once to generate every mode
+        mode_json = yosys.run.vlog_to_json_modes(infiles, smodes, mod.name, flatten=False, aig=False)
+        for smode in smodes:
             mode_xml = ET.SubElement(pb_type_xml, "mode", {"name" : smode})
-            # Rerun Yosys with mode parameter
-            mode_yj = YosysJSON(yosys.run.vlog_to_json(args.infiles, flatten=False, aig=False, mode=smode, module_with_mode=mod.name))
+            mode_yj = YosysJSON(mode_json[smode])
             mode_mod = mode_yj.module(mod.name)
-            make_pb_content(mode_mod, mode_xml, mod_pname, True)
+            make_pb_content(yj, mode_mod, mode_xml, mod_pname, outfile, True)
     else:
-        make_pb_content(mod, pb_type_xml, mod_pname)
+        make_pb_content(yj, mod, pb_type_xml, mod_pname, outfile)
 
     return pb_type_xml
 
-pb_type_xml = make_pb_type(tmod)
+def main(argv=None):
+    """Generate the pb_type.xml, argv are the command line arguments (without
+    the program name)."""
+    args = parser.parse_args(argv)
+    iname = os.path.basename(args.infiles[0])
 
+    outfile = "pb_type.xml"
+    if "o" in args and args.o is not None:
+        outfile = args.o
 
-f = open(outfile, 'w')
-f.write(ET.tostring(pb_type_xml, pretty_print=True).decode('utf-8'))
-f.close()
-print("Generated {} from {}".format(outfile, iname))
+    if args.top is not None:
+        top = args.top
+    else:
+        wm = re.match(r"([A-Za-z0-9_]+)\.sim\.v", iname)
+        if wm:
+            top = wm.group(1).upper()
+        else:
+            print("ERROR file name not of format %.sim.v ({}), cannot detect top level. Manually specify the top level module using --top".format(iname))
+            return 1
+
+    # Only define PB_TYPE while generating this pb_type, so it doesn't leak
+    # into other conversions run by the same process (see v2x_batch.py).
+    yosys.run.add_define("PB_TYPE")
+    try:
+        vjson = yosys.run.vlog_to_json(args.infiles, flatten=False, aig=False)
+        yj = YosysJSON(vjson)
+        tmod = yj.module(top)
+        pb_type_xml = make_pb_type(args.infiles, yj, tmod, outfile)
+    finally:
+        yosys.run.remove_define("PB_TYPE")
+
+    xmlinc.write_xml(outfile, pb_type_xml)
+    print("Generated {} from {}".format(outfile, iname))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import lxml.etree as ET
 import os
+import tempfile
 
 xi_url = "http://www.w3.org/2001/XInclude"
 
@@ -27,3 +28,27 @@ def include_xml(parent, href, outfile, xptr = None):
     if xptr is not None:
         xattrs["xpointer"] = xptr
     return ET.SubElement(parent, xi_include, xattrs)
+
+def write_xml(outfile, xml):
+    """
+    Write an XML tree to a file atomically, so a parallel build never sees a
+    partially written file.
+
+    Inputs
+    ------
+    outfile : path to output file
+    xml : root element of the XML to write
+    """
+    outdir = os.path.dirname(os.path.abspath(outfile))
+    fd, tmpfile = tempfile.mkstemp(dir=outdir, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(ET.tostring(xml, pretty_print=True).decode('utf-8'))
+        # mkstemp creates the file only readable by the user
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpfile, 0o666 & ~umask)
+        os.replace(tmpfile, outfile)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
@@ -10,9 +10,39 @@ import os, sys
 import json
 
 class YosysModule:
+    """A module from the Yosys JSON output.
+
+    >>> m = YosysModule("top", {
+    ...     "ports": {
+    ...         "I": {"direction": "input", "bits": [2, 3]},
+    ...         "O": {"direction": "output", "bits": [4]},
+    ...     },
+    ...     "cells": {
+    ...         "a": {"type": "AND",
+    ...               "port_directions": {"A": "input", "B": "input", "Y": "output"},
+    ...               "connections": {"A": [2], "B": [3], "Y": [5]}},
+    ...         "b": {"type": "BUF",
+    ...               "port_directions": {"A": "input", "Y": "output"},
+    ...               "connections": {"A": [5, 3], "Y": [4]}},
+    ...     },
+    ... })
+    >>> m.net_drivers(3)
+    [('top', 'I[1]')]
+    >>> m.net_sinks(3)
+    [('a', 'B'), ('b', 'A[1]')]
+    >>> m.net_drivers(4), m.net_sinks(4)
+    ([('b', 'Y')], [('top', 'O')])
+    >>> m.net_sinks(6)
+    []
+    """
+
     def __init__(self, name, module_data):
         self.name = name
         self.data = module_data
+        # (direction, net) -> connected top level IO / cell ports, built on
+        # first use by _build_conn_index.
+        self._io_index = None
+        self._port_index = None
 
     @property
     def ports(self):
@@ -121,6 +151,43 @@ class YosysModule:
                         conns.append(("{}[{}]".format(port, i), condata[i]))
         return conns
 
+    @staticmethod
+    def _bit_names(port, bits):
+        """The (net, name) of each net connected to a port, using the name of
+        the first bit if a net is connected more than once."""
+        if len(bits) == 1:
+            return [(bits[0], port)]
+        names = []
+        seen = set()
+        for i, net in enumerate(bits):
+            if net in seen:
+                continue
+            seen.add(net)
+            names.append((net, "{}[{}]".format(port, i)))
+        return names
+
+    def _build_conn_index(self):
+        """Index the top level IO and cell ports connected to each net, in a
+        single pass over the module. The modules are not modified after
+        being loaded, so the index never needs rebuilding."""
+        io_index = {}
+        for port, pdata in sorted(self.data["ports"].items()):
+            for net, name in self._bit_names(port, pdata["bits"]):
+                io_index.setdefault((pdata["direction"], net), []).append(name)
+
+        port_index = {}
+        for cell in sorted(self.data["cells"].keys()):
+            if cell.startswith("$"):
+                continue
+            cdata = self.data["cells"][cell]
+            for port, condata in sorted(cdata["connections"].items()):
+                pdir = cdata["port_directions"][port]
+                for net, name in self._bit_names(port, condata):
+                    port_index.setdefault((pdir, net), []).append((cell, name))
+
+        self._io_index = io_index
+        self._port_index = port_index
+
     def conn_io(self, net, iodir):
         """Returns a list of top level IO matching a direction and connected net number
 
@@ -128,15 +195,9 @@ class YosysModule:
         -------
         port : str
         """
-        conn_io = []
-        for port, pdata in sorted(self.data["ports"].items()):
-            if pdata["direction"] == iodir:
-                if net in pdata["bits"]:
-                    if len(pdata["bits"]) == 1:
-                        conn_io.append(port)
-                    else:
-                        conn_io.append("{}[{}]".format(port, pdata["bits"].index(net)))
-        return conn_io
+        if self._io_index is None:
+            self._build_conn_index()
+        return list(self._io_index.get((iodir, net), []))
 
     def conn_ports(self, net, pdir):
         """Returns any cell ports matching a direction and connected net number
@@ -146,19 +207,9 @@ class YosysModule:
         cell : str
         port : str
         """
-        conn_ports = []
-        for cell in sorted(self.data["cells"].keys()):
-            if cell.startswith("$"):
-                continue
-            cdata = self.data["cells"][cell]
-            for port, condata in sorted(cdata["connections"].items()):
-                if cdata["port_directions"][port] == pdir:
-                    if net in condata:
-                        if len(condata) == 1:
-                            conn_ports.append((cell, port))
-                        else:
-                            conn_ports.append((cell, "{}[{}]".format(port, condata.index(net))))
-        return conn_ports
+        if self._port_index is None:
+            self._build_conn_index()
+        return list(self._port_index.get((pdir, net), []))
 
 
     def net_drivers(self, net):
@@ -209,13 +260,18 @@ class YosysJSON:
                 self.top = None
         else:
             self.top = top
+        # The `YosysModule`s already created, so their connection indexes
+        # are reused.
+        self._modules = {}
 
     def module(self, module):
         """Get a given module (by name) as a `YosysModule`"""
         if module not in self.data["modules"]:
             raise KeyError("No yosys module named {} (only have {})".format(
                 module, self.data["modules"].keys()))
-        return YosysModule(module, self.data["modules"][module])
+        if module not in self._modules:
+            self._modules[module] = YosysModule(module, self.data["modules"][module])
+        return self._modules[module]
 
     def modules_with_attr(self, attr_name, attr_value):
         """Return a list of `YosysModule`s, selecting based on a given attribute"""
@@ -1,13 +1,80 @@
 #!/usr/bin/env python3
 import os, subprocess, sys, re
-import tempfile, json
+import tempfile, json, hashlib
 import yosys.utils
 
+# The Yosys Python bindings are optional, without them Yosys is run as a
+# subprocess.
+try:
+    from pyosys import libyosys as pyosys
+except ImportError:
+    pyosys = None
+
 def get_yosys():
     """Return how to execute Yosys: the value of $YOSYS if set, otherwise just
     `yosys`."""
     return os.getenv("YOSYS", "yosys")
 
+_yosys_version = None
+
+def get_yosys_version():
+    """Return the version string of the Yosys being used"""
+    global _yosys_version
+    if _yosys_version is None:
+        _yosys_version = get_output(["-V"]).strip()
+    return _yosys_version
+
+def get_cache_dir():
+    """Return the directory to cache Yosys JSON output in: the value of
+    $YOSYS_CACHE_DIR if set (set it to an empty string to disable the cache),
+    otherwise `yosys-json` in the user's cache directory ($XDG_CACHE_HOME or
+    ~/.cache)."""
+    user_cache = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.getenv("YOSYS_CACHE_DIR", os.path.join(user_cache, "yosys-json"))
+
+def use_pyosys():
+    """Return True if Yosys should be run in process using the Python
+    bindings: they must be installed, and $YOSYS_BACKEND not set to
+    `subprocess`."""
+    return pyosys is not None and os.getenv("YOSYS_BACKEND", "pyosys") != "subprocess"
+
+# (infiles, defines) -> (pyosys Design, name of its saved copy)
+_pyosys_designs = {}
+
+def _pyosys_design(infiles):
+    """Return a pyosys Design with the given input files read in.
+
+    The files are only read the first time, the design is then saved (with
+    `design -save`) and restored before every use, so each set of commands
+    starts from the freshly read design.
+    """
+    key = (tuple(infiles), get_defines())
+    if key not in _pyosys_designs:
+        design = pyosys.Design()
+        pyosys.run_pass("read_verilog {} {}".format(get_defines(), " ".join(infiles)), design)
+        saved_name = "vlog{}".format(len(_pyosys_designs))
+        pyosys.run_pass("design -save {}".format(saved_name), design)
+        _pyosys_designs[key] = (design, saved_name)
+
+    design, saved_name = _pyosys_designs[key]
+    pyosys.run_pass("design -load {}".format(saved_name), design)
+    return design
+
+def run_commands(commands_str, infiles = []):
+    """Run a given string containing Yosys commands for their side effects
+    (such as writing files), in process if the Python bindings are available
+    and otherwise like `commands`.
+
+    Inputs
+    -------
+    commands_str : string of Yosys commands to run
+    infiles : list of input files
+    """
+    if use_pyosys():
+        pyosys.run_pass(commands_str, _pyosys_design(infiles))
+    else:
+        commands(commands_str, infiles)
+
 def get_output(params):
     """Run Yosys with given command line parameters, and return stdout as a string"""
     cmd = [get_yosys()] + params
@@ -19,6 +86,10 @@ def add_define(defname):
     """Add a Verilog define to the list of defines to set in Yosys"""
     defines.append(defname)
 
+def remove_define(defname):
+    """Remove a Verilog define added with `add_define`"""
+    defines.remove(defname)
+
 def get_defines():
     """Return a list of set Verilog defines, as a list of arguments to pass to Yosys `read_verilog`"""
     return " ".join(["-D" + _ for _ in defines])
@@ -35,6 +106,89 @@ def commands(commands, infiles = []):
     params = ["-q", "-p", commands]
     return get_output(params)
 
+_include_re = re.compile(r'^\s*`include\s+"([^"]+)"')
+
+def verilog_deps(infiles):
+    """Return the absolute paths of the input files and all the files they
+    (recursively) `include"""
+    todo = [os.path.abspath(f) for f in infiles]
+    found = set()
+    while todo:
+        path = todo.pop()
+        if path in found or not os.path.exists(path):
+            continue
+        found.add(path)
+        with open(path, 'r') as f:
+            for line in f:
+                m = _include_re.match(line)
+                if m:
+                    todo.append(os.path.normpath(os.path.join(os.path.dirname(path), m.group(1))))
+    return found
+
+def _cache_file(commands_str, infiles):
+    """Return the path to cache the output of the given commands in, or None
+    if caching is disabled.
+
+    The cache is keyed by the Yosys version, the full command string (which
+    includes the defines) and the contents of the input files and everything
+    they include, so it never returns the output for a different input.
+    """
+    cache_dir = get_cache_dir()
+    if not cache_dir:
+        return None
+
+    h = hashlib.sha256()
+    h.update(get_yosys_version().encode("utf-8"))
+    h.update("read_verilog {} {}; {}".format(get_defines(), " ".join(infiles), commands_str).encode("utf-8"))
+    for path in sorted(verilog_deps(infiles)):
+        h.update(path.encode("utf-8"))
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return os.path.join(cache_dir, h.hexdigest())
+
+def _read_cache(cache_file):
+    """Return the contents of a cache file returned by `_cache_file`, or None
+    if it doesn't exist or can't be read (so it is just regenerated)."""
+    try:
+        with open(cache_file, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _write_cache(cache_file, text):
+    """Write text to a cache file returned by `_cache_file`. Failing to write
+    the cache (e.g. a read only or someone else's cache directory) only
+    prints a warning."""
+    tmp_file = None
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Write to a temporary file first so parallel runs never see a
+        # partial output.
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print("WARNING: unable to write Yosys cache file {}: {}".format(cache_file, e), file=sys.stderr)
+        if tmp_file is not None and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def cached_commands(commands_str, infiles = []):
+    """Run a given string containing Yosys commands, like `commands`, but
+    cache the output on disk (see `_cache_file`).
+    """
+    cache_file = _cache_file(commands_str, infiles)
+    if cache_file is None:
+        return commands(commands_str, infiles)
+
+    output = _read_cache(cache_file)
+    if output is not None:
+        return output
+
+    output = commands(commands_str, infiles)
+    _write_cache(cache_file, output)
+    return output
+
 def script(script, infiles = []):
     """Run a Yosys script given a path to the script
 
@@ -64,13 +218,74 @@ def vlog_to_json(infiles, flatten = False, aig = False, mode = None, module_with
         mode_str = 'chparam -set MODE "{}" {}; '.format(mode, module_with_mode)
     else:
         mode_str = ""
-    cmds = "{}prep {}; write_json {}".format(mode_str, prep_opts, json_opts)
-    j = yosys.utils.strip_yosys_json(commands(cmds, infiles))
+    if use_pyosys():
+        with tempfile.TemporaryDirectory() as tmpdir:
+            json_file = os.path.join(tmpdir, "design.json")
+            run_commands("{}prep {}; write_json {} {}".format(mode_str, prep_opts, json_opts, json_file), infiles)
+            with open(json_file, 'r') as f:
+                j = yosys.utils.strip_yosys_json(f.read())
+    else:
+        cmds = "{}prep {}; write_json {}".format(mode_str, prep_opts, json_opts)
+        j = yosys.utils.strip_yosys_json(cached_commands(cmds, infiles))
     """with open('dump.json', 'w') as dbg:
         print(j,file=dbg)"""
     return json.loads(j)
 
 
+def vlog_to_json_modes(infiles, modes, module_with_mode, flatten = False, aig = False):
+    """
+    Convert Verilog to a JSON representation using Yosys, once for each value
+    of the MODE parameter of a module. All the modes are generated by a single
+    Yosys session (restoring the design read in with `design -load` before
+    each `chparam`), so the input files are only read once.
+
+    Returns a dict of mode -> JSON.
+
+    Inputs
+    -------
+    infiles : list of input files
+    modes : list of values to set the MODE parameter to
+    module_with_mode : the name of the module to set MODE on
+    flatten : set to flatten output hierarchy
+    aig : generate And-Inverter-Graph modules for gates
+    """
+    modes = list(modes)
+    if not modes:
+        return {}
+    prep_opts = "-flatten" if flatten else ""
+    json_opts = "-aig" if aig else ""
+
+    def mode_commands(outdir):
+        cmds = ["design -save v2x_modes"]
+        for i, mode in enumerate(modes):
+            cmds.append('design -load v2x_modes; chparam -set MODE "{}" {}; prep {}; write_json {} {}'.format(
+                mode, module_with_mode, prep_opts, json_opts, os.path.join(outdir, "mode{}.json".format(i))))
+        return "; ".join(cmds)
+
+    # The real output directory is a new temporary one every time, so the
+    # cache is keyed on the commands without it.
+    cache_file = None
+    if not use_pyosys():
+        cache_file = _cache_file(mode_commands(""), infiles)
+        cached = None if cache_file is None else _read_cache(cache_file)
+        if cached is not None:
+            try:
+                return json.loads(cached)
+            except ValueError:
+                pass
+
+    mode_json = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        run_commands(mode_commands(tmpdir), infiles)
+        for i, mode in enumerate(modes):
+            with open(os.path.join(tmpdir, "mode{}.json".format(i)), 'r') as f:
+                mode_json[mode] = json.loads(yosys.utils.strip_yosys_json(f.read()))
+
+    if cache_file is not None:
+        _write_cache(cache_file, json.dumps(mode_json))
+    return mode_json
+
+
 def extract_pin(module, pstr, _regex=re.compile(r"([^/]+)/([^/]+)")):
     """
     Extract the pin from a line of the result of a Yosys select command, or
@@ -101,25 +316,58 @@ def do_select(infiles, module, expr):
     module: Name of module to run command on
     expr: Yosys selector expression for select command
     """
+    return do_select_batch(infiles, module, [expr])[0]
+
+def do_select_batch(infiles, module, exprs):
+    """
+    Run several Yosys select commands on a module using a single Yosys
+    invocation, so the input files are only read and `prep`ed once. Returns a
+    list of pins for each expression, in the same order as `exprs`.
+
+    Inputs
+    -------
+    infiles: List of Verilog source files to pass to Yosys
+    module: Name of module to run commands on
+    exprs: List of Yosys selector expressions for select commands
+    """
+    exprs = list(exprs)
+    if not exprs:
+        return []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outfiles = [os.path.join(tmpdir, "select{}.txt".format(i)) for i in range(len(exprs))]
+        # `select -write` doesn't change the current selection, so each
+        # query is independent of the ones before it.
+        sel_cmds = ["prep -top {} -flatten; cd {}".format(module, module)]
+        for outfile, expr in zip(outfiles, exprs):
+            sel_cmds.append("select -write {} {}".format(outfile, expr))
+        run_commands("; ".join(sel_cmds), infiles)
+
+        results = []
+        for outfile in outfiles:
+            pins = []
+            with open(outfile, 'r') as f:
+                for net in f:
+                    snet = net.strip()
+                    if(len(snet) > 0):
+                        pin = extract_pin(module, snet)
+                        if pin is not None:
+                            pins.append(pin)
+            results.append(pins)
+    return results
 
-    """TODO: All of these functions involve a fairly large number of calls to Yosys
-    Although performance here is unlikely to be a major priority any time soon,
-    it might be worth investigating better options?"""
+def combinational_sinks_expr(innet):
+    """Selector expression for the output ports which are combinational sinks of
+    a given input."""
+    return "{} %coe* o:* %i {} %d".format(innet, innet)
 
+def list_clocks_expr():
+    """Selector expression for the clocks in a module."""
+    return "c:* %x:+[CLK] a:CLOCK=1 %u c:* %d"
 
-    outfile = tempfile.mktemp()
-    sel_cmd = "prep -top {} -flatten; cd {}; select -write {} {}" .format(module, module, outfile, expr)
-    commands(sel_cmd, infiles)
-    pins = []
-    with open(outfile, 'r') as f:
-        for net in f:
-            snet = net.strip()
-            if(len(snet) > 0):
-                pin = extract_pin(module, snet)
-                if pin is not None:
-                    pins.append(pin)
-    os.remove(outfile)
-    return pins
+def clock_assoc_signals_expr(clk):
+    """Selector expression for the signals associated with a given clock."""
+    return "select -list {} %x* i:* o:* %u %i a:ASSOC_CLOCK={} %u {} %d".format(clk, clk, clk)
 
 def get_combinational_sinks(infiles, module, innet):
     """Return a list of output ports which are combinational sinks of a given
@@ -131,7 +379,7 @@ def get_combinational_sinks(infiles, module, innet):
     module: Name of module to run command on
     innet: Name of input net to find sinks of
     """
-    return do_select(infiles, module, "{} %coe* o:* %i {} %d".format(innet, innet))
+    return do_select(infiles, module, combinational_sinks_expr(innet))
 
 def list_clocks(infiles, module):
     """Return a list of clocks in the module
@@ -141,7 +389,7 @@ def list_clocks(infiles, module):
     infiles: List of Verilog source files to pass to Yosys
     module: Name of module to run command on
     """
-    return do_select(infiles, module, "c:* %x:+[CLK] a:CLOCK=1 %u c:* %d")
+    return do_select(infiles, module, list_clocks_expr())
 
 def get_clock_assoc_signals(infiles, module, clk):
     """Return the list of signals associated with a given clock.
@@ -152,4 +400,4 @@ def get_clock_assoc_signals(infiles, module, clk):
     module: Name of module to run command on
     clk: Name of clock to find associated signals
     """
-    return do_select(infiles, module, "select -list {} %x* i:* o:* %u %i a:ASSOC_CLOCK={} %u {} %d".format(clk, clk, clk))
+    return do_select(infiles, module, clock_assoc_signals_expr(clk))